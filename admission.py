@@ -0,0 +1,165 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from metrics import LLM_ADMISSION_QUEUED, LLM_ADMISSION_REJECTED
+
+# تنظیمات کنترل پذیرش فراخوانی‌های مدل زبانی
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_CONCURRENCY_PER_USER = int(os.getenv("LLM_MAX_CONCURRENCY_PER_USER", "2"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "200"))
+LLM_PRIORITY_QUEUE_SIZE = int(os.getenv("LLM_PRIORITY_QUEUE_SIZE", "100"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "15"))
+LLM_PRIORITY_PLANS = {p.strip() for p in os.getenv("LLM_PRIORITY_PLANS", "premium,pro").split(",") if p.strip()}
+
+# تخمین اولیه زمان هر فراخوانی تا اولین اندازه‌گیری واقعی
+INITIAL_SERVICE_TIME = 10.0
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """درخواست پذیرفته نشد؛ retry_after ثانیه‌های پیشنهادی تا تلاش دوباره است"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """مجوز اجرای یک فراخوانی؛ release چند بار قابل فراخوانی است"""
+
+    def __init__(self, controller: "AdmissionController", user_id: str):
+        self.controller = controller
+        self.user_id = user_id
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self.user_id, time.monotonic() - self.started)
+
+
+class AdmissionController:
+    """سقف هم‌زمانی سراسری و هر کاربر، صف محدود با مهلت و مسیر اولویت‌دار"""
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_per_user: int = LLM_MAX_CONCURRENCY_PER_USER,
+        queue_size: int = LLM_QUEUE_SIZE,
+        priority_queue_size: int = LLM_PRIORITY_QUEUE_SIZE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.queue_size = queue_size
+        self.priority_queue_size = priority_queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._user_load: Dict[str, int] = {}
+        self._normal: Deque[asyncio.Future] = deque()
+        self._priority: Deque[asyncio.Future] = deque()
+        self._service_time = INITIAL_SERVICE_TIME
+
+    @property
+    def queued(self) -> int:
+        return len(self._normal) + len(self._priority)
+
+    def retry_after(self, position: Optional[int] = None) -> int:
+        """تخمین ثانیه‌ها تا آزاد شدن ظرفیت بر اساس میانگین زمان فراخوانی‌ها"""
+        ahead = self.queued if position is None else position
+        return max(1, math.ceil((ahead + 1) * self._service_time / max(1, self.max_concurrency)))
+
+    def _reject(self, reason: str, retry_after: float):
+        LLM_ADMISSION_REJECTED.labels(reason).inc()
+        raise AdmissionRejected(reason, retry_after)
+
+    async def acquire(self, user_id: str, priority: bool = False, timeout: Optional[float] = None) -> AdmissionTicket:
+        """گرفتن مجوز اجرا؛ در صورت پر بودن صف یا سقف کاربر بلافاصله AdmissionRejected"""
+        if self._user_load.get(user_id, 0) >= self.max_per_user:
+            self._reject("user_limit", self.retry_after(0))
+
+        if self.active < self.max_concurrency and not self.queued:
+            self._admit(user_id)
+            return AdmissionTicket(self, user_id)
+
+        queue = self._priority if priority else self._normal
+        limit = self.priority_queue_size if priority else self.queue_size
+        if len(queue) >= limit:
+            self._reject("queue_full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        self._user_load[user_id] = self._user_load.get(user_id, 0) + 1
+        LLM_ADMISSION_QUEUED.inc()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout or self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # ظرفیت هم‌زمان با پایان مهلت واگذار شد؛ آن را پس می‌دهیم
+                self._release(user_id, None)
+            else:
+                waiter.cancel()
+                self._drop_load(user_id)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject("queue_timeout", self.retry_after())
+        finally:
+            LLM_ADMISSION_QUEUED.dec()
+            if waiter in queue:
+                queue.remove(waiter)
+        return AdmissionTicket(self, user_id)
+
+    @asynccontextmanager
+    async def admit(self, user_id: str, priority: bool = False):
+        """اجرای یک بلوک تحت کنترل پذیرش"""
+        ticket = await self.acquire(user_id, priority)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def _admit(self, user_id: str):
+        self.active += 1
+        self._user_load[user_id] = self._user_load.get(user_id, 0) + 1
+
+    def _drop_load(self, user_id: str):
+        load = self._user_load.get(user_id, 0) - 1
+        if load > 0:
+            self._user_load[user_id] = load
+        else:
+            self._user_load.pop(user_id, None)
+
+    def _release(self, user_id: str, elapsed: Optional[float]):
+        self.active -= 1
+        self._drop_load(user_id)
+        if elapsed is not None:
+            self._service_time += SERVICE_TIME_SMOOTHING * (elapsed - self._service_time)
+        self._dispatch()
+
+    def _dispatch(self):
+        """واگذاری ظرفیت آزاد به منتظران، ابتدا مسیر اولویت‌دار"""
+        while self.active < self.max_concurrency:
+            queue = self._priority if self._priority else self._normal
+            if not queue:
+                return
+            waiter = queue.popleft()
+            if waiter.done():
+                continue
+            # بار کاربر هنگام ورود به صف ثبت شده است
+            self.active += 1
+            waiter.set_result(True)
+
+
+def is_priority_user(plan: Optional[str]) -> bool:
+    """کاربران پلن‌های پولی در مسیر اولویت‌دار قرار می‌گیرند"""
+    return plan in LLM_PRIORITY_PLANS
+
+
+llm_admission = AdmissionController()
@@ -0,0 +1,251 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import redis
+
+from database import get_async_redis_client
+from metrics import track_redis
+
+logger = logging.getLogger(__name__)
+
+# تنظیمات کش تحلیل‌ها
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+ANALYSIS_CACHE_VARIANTS = max(1, int(os.getenv("ANALYSIS_CACHE_VARIANTS", "3")))
+ANALYSIS_LOCK_TTL = int(os.getenv("ANALYSIS_LOCK_TTL", "90"))
+ANALYSIS_LOCK_POLL_INTERVAL = float(os.getenv("ANALYSIS_LOCK_POLL_INTERVAL", "0.25"))
+# فایل JSON تحلیل‌های از پیش آماده به شکل {"INTJ": "...", ...} برای زمان قطعی سرویس بالادستی
+MBTI_FALLBACK_PATH = os.getenv("MBTI_FALLBACK_PATH", "")
+
+# حذف قفل فقط توسط صاحب آن؛ مقایسه توکن و حذف در یک رفت‌وبرگشت اتمی
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class _LeaderCancelled(Exception):
+    """درخواست تولیدکننده لغو شد؛ منتظرهای آن دوباره تلاش می‌کنند"""
+
+
+# درخواست‌های در جریان این worker؛ هر کلید حداکثر یک فراخوانی بالادستی دارد
+_inflight: Dict[str, asyncio.Future] = {}
+_fallback_analyses: Optional[Dict[str, str]] = None
+
+
+def cache_key(test_type: str, mbti_type: str, prompt_version: int) -> str:
+    """کلید کش برای یک تیپ شخصیتی و نسخه پرامپت"""
+    return f"analysis:{test_type}:{mbti_type.upper()}:v{prompt_version}"
+
+
+async def _read_variants(key: str) -> List[str]:
+    try:
+        with track_redis("analysis_cache_read"):
+            variants = await get_async_redis_client().lrange(key, 0, -1)
+        return [v.decode() for v in variants]
+    except redis.RedisError as e:
+        logger.warning(f"خطا در خواندن کش تحلیل {key}: {e}")
+        return []
+
+
+async def store_variant(key: str, analysis: str):
+    """افزودن یک نسخه جدید تحلیل به کش با حفظ سقف تعداد نسخه‌ها"""
+    try:
+        pipe = get_async_redis_client().pipeline(transaction=True)
+        pipe.rpush(key, analysis)
+        pipe.ltrim(key, -ANALYSIS_CACHE_VARIANTS, -1)
+        pipe.expire(key, ANALYSIS_CACHE_TTL)
+        with track_redis("analysis_cache_write"):
+            await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"خطا در ذخیره کش تحلیل {key}: {e}")
+
+
+async def get_cached_variant(key: str) -> Optional[str]:
+    """یک نسخه تصادفی از کش، فقط وقتی همه نسخه‌های کلید تولید شده باشند"""
+    variants = await _read_variants(key)
+    if len(variants) >= ANALYSIS_CACHE_VARIANTS:
+        return random.choice(variants)
+    return None
+
+
+def _load_fallback_analyses() -> Dict[str, str]:
+    """بارگذاری یک‌باره تحلیل‌های از پیش آماده"""
+    global _fallback_analyses
+    if _fallback_analyses is None:
+        _fallback_analyses = {}
+        if MBTI_FALLBACK_PATH:
+            try:
+                with open(MBTI_FALLBACK_PATH, 'r', encoding='utf-8') as f:
+                    _fallback_analyses = {k.upper(): v for k, v in json.load(f).items()}
+            except (OSError, ValueError) as e:
+                logger.error(f"خطا در بارگذاری تحلیل‌های جایگزین {MBTI_FALLBACK_PATH}: {e}")
+    return _fallback_analyses
+
+
+async def get_fallback_analysis(test_type: str, mbti_type: str, prompt_version: int) -> Optional[str]:
+    """تحلیل جایگزین هنگام در دسترس نبودن مدل: هر نسخه موجود در کش، وگرنه متن از پیش آماده"""
+    variants = await _read_variants(cache_key(test_type, mbti_type, prompt_version))
+    if variants:
+        return random.choice(variants)
+    return _load_fallback_analyses().get(mbti_type.upper())
+
+
+async def _acquire_lock(lock_key: str, token: str) -> bool:
+    try:
+        with track_redis("analysis_lock_acquire"):
+            return bool(await get_async_redis_client().set(lock_key, token, nx=True, ex=ANALYSIS_LOCK_TTL))
+    except redis.RedisError as e:
+        logger.warning(f"خطا در گرفتن قفل {lock_key}: {e}")
+        # بدون Redis هماهنگی بین workerها ممکن نیست؛ خود این worker تولید می‌کند
+        return True
+
+
+async def _release_lock(lock_key: str, token: str):
+    try:
+        release = get_async_redis_client().register_script(RELEASE_LOCK_SCRIPT)
+        with track_redis("analysis_lock_release"):
+            await release(keys=[lock_key], args=[token])
+    except redis.RedisError as e:
+        logger.warning(f"خطا در آزادسازی قفل {lock_key}: {e}")
+
+
+async def _wait_for_lock(key: str, lock_key: str, token: str, variants: List[str]) -> Optional[str]:
+    """گرفتن قفل توزیع‌شده؛ اگر در حین انتظار نسخه‌ای در کش باشد همان برگردانده می‌شود"""
+    while not await _acquire_lock(lock_key, token):
+        # worker دیگری در حال تولید است؛ اگر نسخه‌ای داریم همان را برگردان
+        if variants:
+            return random.choice(variants)
+        await asyncio.sleep(ANALYSIS_LOCK_POLL_INTERVAL)
+        variants = await _read_variants(key)
+        if variants:
+            return random.choice(variants)
+    return None
+
+
+async def _generate_once(key: str, variants: List[str], generate: Callable[[], Awaitable[str]]) -> str:
+    """تولید یک نسخه جدید با قفل توزیع‌شده بین workerها"""
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+
+    cached = await _wait_for_lock(key, lock_key, token, variants)
+    if cached is not None:
+        return cached
+
+    try:
+        analysis = await generate()
+        await store_variant(key, analysis)
+        return analysis
+    finally:
+        await _release_lock(lock_key, token)
+
+
+async def _follow_inflight(key: str) -> Tuple[Optional[str], List[str]]:
+    """نسخه کش یا نتیجه تولیدکننده هم‌کلید این worker؛ تحلیل None یعنی فراخواننده خودش تولید کند"""
+    while True:
+        variants = await _read_variants(key)
+        if len(variants) >= ANALYSIS_CACHE_VARIANTS:
+            return random.choice(variants), variants
+
+        inflight = _inflight.get(key)
+        if inflight is None:
+            return None, variants
+        if variants:
+            return random.choice(variants), variants
+        try:
+            return await asyncio.shield(inflight), variants
+        except _LeaderCancelled:
+            # تولیدکننده لغو شد؛ یکی از منتظرها جای آن را می‌گیرد
+            continue
+
+
+def _fail_inflight(future: asyncio.Future, error: BaseException):
+    """اعلام شکست تولیدکننده به منتظرهای آن"""
+    if not future.done():
+        future.set_exception(error)
+        # جلوگیری از هشدار «exception was never retrieved» وقتی منتظری وجود ندارد
+        future.exception()
+
+
+async def get_or_generate(
+    test_type: str,
+    mbti_type: str,
+    prompt_version: int,
+    generate: Callable[[], Awaitable[str]],
+) -> str:
+    """دریافت تحلیل از کش یا تولید آن با ادغام درخواست‌های هم‌زمان"""
+    key = cache_key(test_type, mbti_type, prompt_version)
+    analysis, variants = await _follow_inflight(key)
+    if analysis is not None:
+        return analysis
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        analysis = await _generate_once(key, variants, generate)
+        future.set_result(analysis)
+        return analysis
+    except asyncio.CancelledError:
+        # لغو تولیدکننده نباید منتظرهای محافظت‌شده را هم لغو کند
+        _fail_inflight(future, _LeaderCancelled())
+        raise
+    except Exception as e:
+        _fail_inflight(future, e)
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+
+async def stream_or_generate(
+    test_type: str,
+    mbti_type: str,
+    prompt_version: int,
+    stream: Callable[[], AsyncIterator[str]],
+) -> AsyncIterator[str]:
+    """نسخه جریانی get_or_generate؛ فقط تولیدکننده بخش‌ها را از بالادست می‌گیرد و منتظرها متن کامل را یکجا دریافت می‌کنند"""
+    key = cache_key(test_type, mbti_type, prompt_version)
+    analysis, variants = await _follow_inflight(key)
+    if analysis is not None:
+        yield analysis
+        return
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    try:
+        cached = await _wait_for_lock(key, lock_key, token, variants)
+        if cached is not None:
+            future.set_result(cached)
+            yield cached
+            return
+
+        try:
+            parts = []
+            upstream = stream()
+            try:
+                async for delta in upstream:
+                    parts.append(delta)
+                    yield delta
+            finally:
+                # بستن جریان بالادستی حتی وقتی کلاینت قطع شده یا این generator لغو شده است
+                await upstream.aclose()
+            analysis = "".join(parts)
+            await store_variant(key, analysis)
+            future.set_result(analysis)
+        finally:
+            await _release_lock(lock_key, token)
+    except (asyncio.CancelledError, GeneratorExit):
+        _fail_inflight(future, _LeaderCancelled())
+        raise
+    except Exception as e:
+        _fail_inflight(future, e)
+        raise
+    finally:
+        _inflight.pop(key, None)
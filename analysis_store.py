@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import bindparam, inspect, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+try:
+    import zstandard
+except ImportError:  # zstandard اختیاری است؛ بدون آن متن‌ها فشرده نمی‌شوند
+    zstandard = None
+
+from models import AnalysisBlob, TestResult
+
+logger = logging.getLogger(__name__)
+
+# تنظیمات ذخیره‌سازی تحلیل‌ها
+ANALYSIS_COMPRESSION = os.getenv("ANALYSIS_COMPRESSION", "zstd" if zstandard is not None else "identity")
+ANALYSIS_ZSTD_LEVEL = int(os.getenv("ANALYSIS_ZSTD_LEVEL", "10"))
+# متن‌های کوتاه‌تر از این آستانه از فشرده‌سازی سودی نمی‌برند
+ANALYSIS_COMPRESSION_MIN_SIZE = int(os.getenv("ANALYSIS_COMPRESSION_MIN_SIZE", "256"))
+ANALYSIS_BACKFILL_BATCH_SIZE = int(os.getenv("ANALYSIS_BACKFILL_BATCH_SIZE", "500"))
+
+
+def analysis_hash(analysis: str) -> str:
+    """کلید محتوایی یک تحلیل"""
+    return hashlib.sha256(analysis.encode("utf-8")).hexdigest()
+
+
+def encode_analysis(analysis: str) -> Tuple[bytes, str]:
+    """تبدیل متن به بایت‌های ذخیره‌شده و نام کدگذاری"""
+    raw = analysis.encode("utf-8")
+    if ANALYSIS_COMPRESSION == "zstd" and zstandard is not None and len(raw) >= ANALYSIS_COMPRESSION_MIN_SIZE:
+        compressed = zstandard.ZstdCompressor(level=ANALYSIS_ZSTD_LEVEL).compress(raw)
+        if len(compressed) < len(raw):
+            return compressed, "zstd"
+    return raw, "identity"
+
+
+def decode_analysis(body: bytes, encoding: str) -> str:
+    """بازگرداندن متن از بایت‌های ذخیره‌شده"""
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read compressed analyses")
+        body = zstandard.ZstdDecompressor().decompress(body)
+    return bytes(body).decode("utf-8")
+
+
+def _insert_ignore(dialect_name: str):
+    """درج بدون خطا در صورت وجود کلید؛ دو درخواست هم‌زمان با متن یکسان تداخل ندارند"""
+    if dialect_name == "postgresql":
+        return pg_insert(AnalysisBlob).on_conflict_do_nothing(index_elements=["hash"])
+    if dialect_name == "sqlite":
+        return sqlite_insert(AnalysisBlob).on_conflict_do_nothing(index_elements=["hash"])
+    return None
+
+
+def _blob_row(analysis: str) -> dict:
+    body, encoding = encode_analysis(analysis)
+    return {
+        "hash": analysis_hash(analysis),
+        "encoding": encoding,
+        "body": body,
+        "size": len(analysis.encode("utf-8")),
+    }
+
+
+async def store_analyses(db: AsyncSession, analyses: Iterable[str]) -> Dict[str, str]:
+    """ذخیره یک‌باره متن‌های جدید؛ خروجی نگاشت متن به هش آن است"""
+    rows = {}
+    for analysis in analyses:
+        if analysis not in rows:
+            rows[analysis] = _blob_row(analysis)
+    if not rows:
+        return {}
+
+    statement = _insert_ignore(db.bind.dialect.name)
+    if statement is not None:
+        await db.execute(statement, list(rows.values()))
+    else:
+        existing = set((await db.execute(
+            select(AnalysisBlob.hash).where(AnalysisBlob.hash.in_([row["hash"] for row in rows.values()]))
+        )).scalars())
+        db.add_all(AnalysisBlob(**row) for row in rows.values() if row["hash"] not in existing)
+        await db.flush()
+    return {analysis: row["hash"] for analysis, row in rows.items()}
+
+
+async def store_analysis(db: AsyncSession, analysis: str) -> str:
+    """ذخیره متن تحلیل (در صورت نبود) و برگرداندن هش آن برای TestResult.analysis_hash"""
+    return (await store_analyses(db, [analysis]))[analysis]
+
+
+def migrate_schema(connection):
+    """افزودن ستون‌های جدید به جدول‌های قدیمی users و test_results (اجرا درون run_sync)"""
+    user_columns = {column["name"] for column in inspect(connection).get_columns("users")}
+    if "plan" not in user_columns:
+        connection.execute(text("ALTER TABLE users ADD COLUMN plan VARCHAR(20) NOT NULL DEFAULT 'free'"))
+        logger.info("ستون plan به users اضافه شد")
+
+    columns = {column["name"] for column in inspect(connection).get_columns("test_results")}
+    if "analysis_hash" not in columns:
+        connection.execute(text("ALTER TABLE test_results ADD COLUMN analysis_hash VARCHAR(64)"))
+        logger.info("ستون analysis_hash به test_results اضافه شد")
+    if "ingested_at" not in columns:
+        connection.execute(text("ALTER TABLE test_results ADD COLUMN ingested_at TIMESTAMP"))
+        # زمان درج ردیف‌های قدیمی معلوم نیست؛ created_at نزدیک‌ترین مقدار است
+        connection.execute(text("UPDATE test_results SET ingested_at = created_at WHERE ingested_at IS NULL"))
+        logger.info("ستون ingested_at به test_results اضافه شد")
+
+
+async def backfill(batch_size: int = ANALYSIS_BACKFILL_BATCH_SIZE) -> int:
+    """انتقال متن ردیف‌های قدیمی به analysis_blobs و خالی کردن ستون analysis آن‌ها"""
+    from database import AsyncSessionLocal, async_engine
+
+    async with async_engine.begin() as connection:
+        await connection.run_sync(lambda conn: AnalysisBlob.__table__.create(conn, checkfirst=True))
+        await connection.run_sync(migrate_schema)
+
+    moved = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(TestResult.id, TestResult.legacy_analysis)
+                .where(TestResult.analysis_hash.is_(None), TestResult.legacy_analysis != "")
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            hashes = await store_analyses(db, [row.legacy_analysis for row in rows])
+            await db.execute(
+                update(TestResult.__table__)
+                .where(TestResult.__table__.c.id == bindparam("result_id"))
+                .values(analysis_hash=bindparam("blob_hash"), analysis=""),
+                [{"result_id": row.id, "blob_hash": hashes[row.legacy_analysis]} for row in rows],
+            )
+            await db.commit()
+        moved += len(rows)
+        logger.info(f"{moved} نتیجه به ذخیره‌سازی محتوایی منتقل شد")
+    return moved
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Move inline test_results.analysis texts into analysis_blobs")
+    parser.add_argument("--batch-size", type=int, default=ANALYSIS_BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+    total = asyncio.run(backfill(args.batch_size))
+    # در PostgreSQL پس از انتقال، VACUUM فضای آزادشده جدول را بازیابی می‌کند
+    print(f"✅ {total} rows migrated")
@@ -1,5 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { runPython } from '@/ml/bridge/run_python';
+import { runPredict } from '@/ml/bridge/run_python';
 
 export async function POST(request: NextRequest) {
   try {
@@ -13,8 +13,8 @@ export async function POST(request: NextRequest) {
       );
     }
 
-    // اجرای مدل ML
-    const output = await runPython('ml/core/predict.py', [JSON.stringify(userData)]);
+    // اجرای مدل ML (سرور مقیم در صورت وجود، در غیر این صورت اجرای مستقیم اسکریپت)
+    const output = await runPredict(userData);
     const result = JSON.parse(output);
 
     return NextResponse.json(result);
@@ -1,14 +1,26 @@
 from datetime import datetime, timedelta
 from typing import Optional
+from collections import OrderedDict
+from dataclasses import dataclass
+import asyncio
+import logging
+import os
+import time
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import random
 import string
-from database import get_db, redis_client
+import redis
+from database import get_async_db, get_async_redis_client
+from otp_store import get_otp_store
+from metrics import track_redis
 from models import User
 
+logger = logging.getLogger(__name__)
+
 # تنظیمات JWT
 SECRET_KEY = "your-secret-key-here"  # در محیط واقعی از متغیر محیطی استفاده کنید
 ALGORITHM = "HS256"
@@ -16,20 +28,78 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# تنظیمات کش کاربران احراز هویت‌شده
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "300"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+USER_INVALIDATION_CHANNEL = "auth:user-invalidated"
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """اطلاعات تغییرناپذیر کاربر احراز هویت‌شده"""
+    id: str
+    phone: str
+    created_at: Optional[datetime] = None
+    plan: str = "free"
+
+    @classmethod
+    def from_user(cls, user: User) -> "CurrentUser":
+        return cls(id=user.id, phone=user.phone, created_at=user.created_at, plan=user.plan or "free")
+
+class PrincipalCache:
+    """کش LRU با انقضای زمانی از توکن تاییدشده به کاربر"""
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[CurrentUser]:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        expires_at, principal = entry
+        if expires_at <= time.monotonic():
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        return principal
+
+    def set(self, token: str, principal: CurrentUser, token_exp: Optional[float] = None):
+        ttl = self.ttl
+        if token_exp is not None:
+            # هیچ ورودی نباید بیشتر از خود توکن عمر کند
+            ttl = min(ttl, token_exp - time.time())
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._entries[token] = (time.monotonic() + ttl, principal)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def evict_user(self, user_id: str):
+        for token in [t for t, (_, p) in self._entries.items() if p.id == user_id]:
+            del self._entries[token]
+
+    def clear(self):
+        self._entries.clear()
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
 def generate_otp() -> str:
     """تولید کد OTP 5 رقمی"""
     return ''.join(random.choices(string.digits, k=5))
 
-def store_otp(phone: str, otp: str):
-    """ذخیره کد OTP در Redis با زمان انقضای 5 دقیقه"""
-    redis_client.setex(f"otp:{phone}", 300, otp)  # 300 ثانیه = 5 دقیقه
+async def store_otp(phone: str, otp: str):
+    """ذخیره کد OTP با زمان انقضای 5 دقیقه"""
+    await get_otp_store().store(phone, otp)
 
-def verify_otp(phone: str, otp: str) -> bool:
-    """بررسی صحت کد OTP"""
-    stored_otp = redis_client.get(f"otp:{phone}")
-    if not stored_otp:
-        return False
-    return stored_otp.decode() == otp
+async def verify_otp(phone: str, otp: str) -> bool:
+    """بررسی صحت کد OTP؛ کد معتبر پس از تایید مصرف می‌شود"""
+    return await get_otp_store().verify(phone, otp)
+
+async def check_otp_send_limit(phone: str, ip: Optional[str] = None) -> float:
+    """بررسی محدودیت ارسال OTP؛ صفر یعنی مجاز"""
+    return await get_otp_store().check_send_limit(phone, ip)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """ایجاد توکن JWT"""
@@ -42,13 +112,17 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     """دریافت کاربر فعلی از توکن JWT"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
@@ -57,7 +131,42 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = (await db.execute(select(User).where(User.id == user_id))).scalar_one_or_none()
     if user is None:
         raise credentials_exception
-    return user 
\ No newline at end of file
+
+    # پلن از رکورد کاربر خوانده می‌شود تا تغییر آن بدون صدور توکن جدید اعمال شود
+    principal = CurrentUser.from_user(user)
+    principal_cache.set(token, principal, payload.get("exp"))
+    return principal
+
+async def invalidate_user(user_id: str):
+    """حذف کاربر از کش همه workerها؛ پس از حذف حساب یا تغییر پلن فراخوانی می‌شود"""
+    principal_cache.evict_user(user_id)
+    try:
+        with track_redis("user_invalidate"):
+            await get_async_redis_client().publish(USER_INVALIDATION_CHANNEL, user_id)
+    except redis.RedisError as e:
+        logger.warning(f"خطا در انتشار ابطال کاربر {user_id}: {e}")
+
+async def listen_for_user_invalidations():
+    """گوش دادن به پیام‌های ابطال کاربر از Redis و پاک کردن کش محلی"""
+    while True:
+        pubsub = get_async_redis_client().pubsub()
+        try:
+            await pubsub.subscribe(USER_INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    principal_cache.evict_user(message["data"].decode())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # در نبود Redis کش فقط با TTL منقضی می‌شود
+            logger.warning(f"اتصال به کانال ابطال کاربران قطع شد: {e}")
+        finally:
+            # اتصال pubsub به pool برگردانده می‌شود تا هر اتصال دوباره یک اتصال از pool را هدر ندهد
+            try:
+                await pubsub.aclose()
+            except redis.RedisError:
+                pass
+        await asyncio.sleep(5)
@@ -0,0 +1,86 @@
+"""
+سرور جعلی OpenAI برای بنچمارک بدون مصرف سهمیه واقعی
+فقط /v1/chat/completions (معمولی و جریانی) را با تأخیر و نرخ تولید توکن قابل تنظیم شبیه‌سازی می‌کند
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+
+import orjson
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+# کلمه نمونه فارسی؛ هر کلمه یک توکن در نظر گرفته می‌شود
+SAMPLE_TOKEN = "تحلیل "
+
+
+def create_app(latency: float = 0.5, tokens_per_second: float = 200.0, completion_tokens: int = 600) -> FastAPI:
+    """ساخت برنامه سرور جعلی با تأخیر اولیه و نرخ تولید مشخص"""
+    app = FastAPI(default_response_class=ORJSONResponse)
+    token_interval = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+
+    def chunk(completion_id: str, model: str, content: str = None, finish_reason: str = None) -> bytes:
+        delta = {"content": content} if content is not None else {}
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake-model")
+        max_tokens = min(body.get("max_tokens") or completion_tokens, completion_tokens)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if body.get("stream"):
+            async def stream():
+                await asyncio.sleep(latency)
+                for _ in range(max_tokens):
+                    yield chunk(completion_id, model, SAMPLE_TOKEN)
+                    await asyncio.sleep(token_interval)
+                yield chunk(completion_id, model, finish_reason="stop")
+                yield b"data: [DONE]\n\n"
+
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency + max_tokens * token_interval)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": SAMPLE_TOKEN * max_tokens},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": max_tokens, "total_tokens": 100 + max_tokens},
+        }
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake OpenAI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.5, help="time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--completion-tokens", type=int, default=600)
+    args = parser.parse_args()
+
+    app = create_app(args.latency, args.tokens_per_second, args.completion_tokens)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""
+جایگزین درون‌حافظه‌ای Redis برای بنچمارک
+کلاینت‌های همگام و ناهمگام database.py را با fakeredis (با پشتیبانی Lua) روی یک سرور مشترک جایگزین می‌کند
+"""
+
+import fakeredis
+
+import database
+
+
+def install_fake_redis() -> fakeredis.FakeServer:
+    """نصب Redis درون‌حافظه‌ای به جای کلاینت‌های واقعی؛ باید قبل از اولین استفاده فراخوانی شود"""
+    server = fakeredis.FakeServer()
+    database._redis_client = fakeredis.FakeRedis(server=server)
+    database._async_redis_client = fakeredis.FakeAsyncRedis(server=server)
+    return server
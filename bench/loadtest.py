@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+بنچمارک بار سرویس FastAPI با وابستگی‌های جعلی
+مسیر کامل کاربر (send-otp → verify-otp → analyze → داشبورد) را در سطوح مختلف هم‌زمانی اجرا می‌کند
+و برای هر endpoint توان عملیاتی، p50/p95/p99 و نرخ خطا را گزارش می‌دهد.
+
+نمونه اجرا:
+    python bench/loadtest.py --concurrency 1,10,50,200 --duration 20 --llm-latency 2
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+import uvicorn
+
+# اضافه کردن ریشه پروژه به path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app, port: int) -> uvicorn.Server:
+    """اجرای یک برنامه ASGI در thread جداگانه و انتظار تا آماده شدن"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    """جمع‌آوری تأخیر و وضعیت پاسخ هر endpoint"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def call(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            response, failed = None, True
+        self.latencies[name].append(time.perf_counter() - started)
+        if failed:
+            self.errors[name] += 1
+        return response
+
+    def report(self, elapsed: float) -> Dict[str, dict]:
+        rows = {}
+        for name, samples in self.latencies.items():
+            rows[name] = {
+                "requests": len(samples),
+                "errors": self.errors[name],
+                "error_rate": round(self.errors[name] / len(samples), 4),
+                "rps": round(len(samples) / elapsed, 2),
+                "p50_ms": round(percentile(samples, 50) * 1000, 2),
+                "p95_ms": round(percentile(samples, 95) * 1000, 2),
+                "p99_ms": round(percentile(samples, 99) * 1000, 2),
+            }
+        return rows
+
+
+async def user_journey(client: httpx.AsyncClient, recorder: Recorder, redis_client, mbti_types: List[str]):
+    """یک مسیر کامل کاربر با شماره تصادفی"""
+    phone = "09" + "".join(random.choices("0123456789", k=9))
+
+    response = await recorder.call(client, "send_otp", "POST", "/auth/send-otp", json={"phone": phone})
+    if response is None or response.status_code != 200:
+        return
+    otp = (await redis_client.get(f"otp:{phone}")).decode()
+
+    response = await recorder.call(
+        client, "verify_otp", "POST", "/auth/verify-otp", json={"phone": phone, "otp": otp}
+    )
+    if response is None or response.status_code != 200:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    await recorder.call(
+        client, "analyze", "POST", "/analyze", json={"mbti_type": random.choice(mbti_types)}, headers=headers
+    )
+    await recorder.call(client, "dashboard_page", "GET", "/dashboard/results", headers=headers)
+    await recorder.call(client, "dashboard_full", "GET", "/dashboard/test-results", headers=headers)
+
+
+async def run_level(base_url: str, concurrency: int, duration: float, redis_server, mbti_types: List[str]):
+    """اجرای مسیرهای کاربر با تعداد مشخص کاربر هم‌زمان در یک بازه زمانی"""
+    import fakeredis
+
+    recorder = Recorder()
+    # کلاینت ناهمگام جدا روی همان سرور جعلی؛ کلاینت سرویس به event loop thread سرور تعلق دارد
+    # و خواندن همگام OTP event loop تولیدکننده بار را مسدود می‌کرد
+    redis_client = fakeredis.FakeAsyncRedis(server=redis_server)
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        async def virtual_user():
+            while time.perf_counter() < deadline:
+                await user_journey(client, recorder, redis_client, mbti_types)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(virtual_user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    await redis_client.aclose()
+    return recorder.report(elapsed)
+
+
+def print_report(concurrency: int, rows: Dict[str, dict]):
+    print(f"\n👥 concurrency={concurrency}")
+    print(f"{'endpoint':<16}{'requests':>10}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>10}")
+    for name, row in rows.items():
+        print(
+            f"{name:<16}{row['requests']:>10}{row['rps']:>10}{row['p50_ms']:>10}"
+            f"{row['p95_ms']:>10}{row['p99_ms']:>10}{row['error_rate']:>10.2%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Testology API load test with stubbed dependencies")
+    parser.add_argument("--concurrency", default="1,10,50,100", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per concurrency level")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="fake OpenAI time to first token (s)")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--llm-completion-tokens", type=int, default=600)
+    parser.add_argument("--mbti-types", type=int, default=16, help="number of distinct MBTI types requested")
+    parser.add_argument("--json", dest="json_path", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    # وابستگی‌های جعلی باید قبل از import برنامه تنظیم شوند
+    from bench.fake_openai import create_app as create_fake_openai
+
+    llm_port = free_port()
+    start_server(
+        create_fake_openai(args.llm_latency, args.llm_tokens_per_second, args.llm_completion_tokens), llm_port
+    )
+    workdir = tempfile.mkdtemp(prefix="testology-bench-")
+    os.environ["OPENAI_API_KEY"] = "sk-bench"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{llm_port}/v1"
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ.setdefault("OTP_SEND_LIMIT_PER_IP", "1000000000")
+    # سرویس لاگینگ را در lifespan با LOG_LEVEL پیکربندی می‌کند
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from bench.fake_redis import install_fake_redis
+    redis_server = install_fake_redis()
+    import main as service
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    api_port = free_port()
+    start_server(service.app, api_port)
+    base_url = f"http://127.0.0.1:{api_port}"
+    while httpx.get(f"{base_url}/health/ready").status_code != 200:
+        time.sleep(0.05)
+
+    all_types = ["".join(letters) for letters in itertools.product("EI", "SN", "TF", "JP")]
+    mbti_types = all_types[:max(1, args.mbti_types)]
+
+    results = {}
+    for concurrency in [int(level) for level in args.concurrency.split(",")]:
+        rows = asyncio.run(run_level(base_url, concurrency, args.duration, redis_server, mbti_types))
+        results[concurrency] = rows
+        print_report(concurrency, rows)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
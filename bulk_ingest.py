@@ -0,0 +1,153 @@
+import logging
+import os
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Type
+
+import orjson
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from analysis_store import store_analyses
+from ids import new_id
+from models import TestResult
+
+logger = logging.getLogger(__name__)
+
+# تنظیمات ورود گروهی نتایج
+BULK_INGEST_BATCH_SIZE = int(os.getenv("BULK_INGEST_BATCH_SIZE", "500"))
+BULK_INGEST_MAX_ROWS = int(os.getenv("BULK_INGEST_MAX_ROWS", "50000"))
+BULK_INGEST_MAX_ERRORS = int(os.getenv("BULK_INGEST_MAX_ERRORS", "100"))
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl", "application/ndjson")
+
+# هر سطر ورودی: شماره سطر (از ۱) و یا شیء خام یا خطای تجزیه
+RawRow = Tuple[int, Optional[object], Optional[str]]
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[RawRow]:
+    """تجزیه سطر به سطر بدنه NDJSON همزمان با دریافت آن"""
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield _parse_line(line_number, line)
+    if buffer.strip():
+        yield _parse_line(line_number + 1, buffer)
+
+
+def _parse_line(line_number: int, line: bytes) -> RawRow:
+    try:
+        return line_number, orjson.loads(line), None
+    except orjson.JSONDecodeError as e:
+        return line_number, None, f"invalid JSON: {e}"
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[RawRow]:
+    """بدنه آرایه JSON؛ شماره هر عنصر به جای شماره سطر گزارش می‌شود"""
+    body = b"".join([chunk async for chunk in chunks])
+    try:
+        items = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        yield 0, None, f"invalid JSON: {e}"
+        return
+    if not isinstance(items, list):
+        yield 0, None, "expected a JSON array"
+        return
+    for index, item in enumerate(items, start=1):
+        yield index, item, None
+
+
+class IngestReport:
+    """خلاصه ورود گروهی: تعداد ردیف‌های ذخیره‌شده و خطای هر ردیف"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors: List[Dict[str, object]] = []
+
+    def error(self, line: int, detail: str):
+        self.failed += 1
+        if len(self.errors) < BULK_INGEST_MAX_ERRORS:
+            self.errors.append({"line": line, "error": detail})
+
+    def as_dict(self) -> dict:
+        return {"inserted": self.inserted, "failed": self.failed, "errors": self.errors}
+
+
+async def _insert_rows(db: AsyncSession, user_id: str, batch: List[Tuple[int, BaseModel]]):
+    """درج ردیف‌ها با executemany و commit در یک تراکنش"""
+    hashes = await store_analyses(db, (row.analysis for _, row in batch))
+    now = datetime.utcnow()
+    await db.execute(insert(TestResult), [
+        {
+            "id": new_id(),
+            "user_id": user_id,
+            "test_type": row.test_type,
+            "mbti_type": row.mbti_type,
+            "analysis_hash": hashes[row.analysis],
+            "created_at": row.created_at or now,
+            "ingested_at": now,
+        }
+        for _, row in batch
+    ])
+    await db.commit()
+
+
+async def _write_batch(db: AsyncSession, user_id: str, batch: List[Tuple[int, BaseModel]], report: IngestReport):
+    """درج یک دسته در یک تراکنش؛ اگر دسته ناموفق باشد ردیف‌ها تک‌تک درج می‌شوند تا فقط ردیف‌های خراب خطا بگیرند"""
+    try:
+        await _insert_rows(db, user_id, batch)
+        report.inserted += len(batch)
+        return
+    except SQLAlchemyError as e:
+        await db.rollback()
+        logger.warning(f"خطا در ذخیره دسته نتایج، درج تک‌تک ردیف‌ها: {e}")
+
+    for line, row in batch:
+        try:
+            await _insert_rows(db, user_id, [(line, row)])
+            report.inserted += 1
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"خطا در ذخیره ردیف {line}: {e}")
+            report.error(line, f"database error: {str(getattr(e, 'orig', None) or e).splitlines()[0]}")
+
+
+async def ingest_test_results(
+    db: AsyncSession,
+    user_id: str,
+    rows: AsyncIterator[RawRow],
+    schema: Type[BaseModel],
+    batch_size: int = BULK_INGEST_BATCH_SIZE,
+) -> IngestReport:
+    """اعتبارسنجی جریانی ردیف‌ها و ذخیره آن‌ها در دسته‌های batch_size تایی"""
+    report = IngestReport()
+    batch: List[Tuple[int, BaseModel]] = []
+    seen = 0
+    async for line, raw, parse_error in rows:
+        seen += 1
+        if seen > BULK_INGEST_MAX_ROWS:
+            report.error(line, f"row limit of {BULK_INGEST_MAX_ROWS} exceeded, remaining rows ignored")
+            break
+        if parse_error is not None:
+            report.error(line, parse_error)
+            continue
+        try:
+            batch.append((line, schema.model_validate(raw)))
+        except ValidationError as e:
+            report.error(line, "; ".join(
+                f"{'.'.join(str(part) for part in err['loc']) or 'row'}: {err['msg']}" for err in e.errors()
+            ))
+            continue
+        if len(batch) >= batch_size:
+            await _write_batch(db, user_id, batch, report)
+            batch = []
+    if batch:
+        await _write_batch(db, user_id, batch, report)
+    return report
@@ -0,0 +1,100 @@
+import gzip
+import os
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # brotli اختیاری است؛ بدون آن فقط gzip ارائه می‌شود
+    brotli = None
+
+# تنظیمات فشرده‌سازی پاسخ‌ها
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1000"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml")
+
+
+def select_encoding(accept_encoding: str) -> Optional[str]:
+    """انتخاب بهترین کدگذاری پشتیبانی‌شده از هدر Accept-Encoding"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    """فشرده‌سازی gzip/brotli پاسخ‌های کامل بزرگ‌تر از آستانه؛ پاسخ‌های جریانی دست‌نخورده عبور می‌کنند"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = select_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if "content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    passthrough = True
+                    await send(message)
+                    return
+                # بدنه این پاسخ به Accept-Encoding بستگی دارد، چه این بار فشرده شود چه نه؛
+                # بدون Vary یک proxy ممکن است نسخه فشرده‌نشده را به کلاینت دیگری بدهد و برعکس
+                MutableHeaders(raw=message["headers"]).add_vary_header("Accept-Encoding")
+                if encoding is None:
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                # پاسخ جریانی (مثل SSE) یا کوچک: بدون فشرده‌سازی ارسال می‌شود
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            if encoding == "br":
+                compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+            else:
+                compressed = gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,7 +1,10 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 import redis
+import redis.asyncio
 import os
 from dotenv import load_dotenv
 
@@ -12,13 +15,95 @@ SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./testology.db")
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# تنظیمات Redis
+# تنظیمات استخر اتصال ناهمگام
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+
+# درایور ناهمگام متناظر با هر درایور همگام
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+def build_async_engine(database_url: str):
+    """ساخت موتور ناهمگام بر اساس DATABASE_URL (asyncpg برای Postgres و aiosqlite برای SQLite)"""
+    url = make_url(database_url)
+    url = url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+    options = {"pool_pre_ping": True, "query_cache_size": DB_STATEMENT_CACHE_SIZE}
+    if url.get_backend_name() != "sqlite":
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    if url.drivername == "postgresql+asyncpg":
+        url = url.update_query_dict({"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)})
+
+    return create_async_engine(url, **options)
+
+async_engine = build_async_engine(SQLALCHEMY_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+# تنظیمات Redis؛ کلاینت‌ها در اولین استفاده ساخته می‌شوند تا import به Redis وابسته نباشد
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
-redis_client = redis.from_url(REDIS_URL)
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "100"))
+# مهلت اتصال و خواندن تا Redis در دسترس‌ناپذیر worker را معطل نکند (ثانیه)
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "2"))
+# انتظار برای اتصال آزاد وقتی همه REDIS_MAX_CONNECTIONS اتصال در حال استفاده‌اند (ثانیه)
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+_redis_client = None
+_async_redis_client = None
+
+def get_redis_client():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.from_url(
+            REDIS_URL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        )
+    return _redis_client
+
+def get_async_redis_client():
+    global _async_redis_client
+    if _async_redis_client is None:
+        # در اوج بار درخواست‌ها منتظر اتصال آزاد می‌مانند به جای خطای «Too many connections»
+        pool = redis.asyncio.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        )
+        _async_redis_client = redis.asyncio.Redis(connection_pool=pool)
+    return _async_redis_client
+
+async def close_redis_clients():
+    global _redis_client, _async_redis_client
+    if _async_redis_client is not None:
+        await _async_redis_client.aclose()
+        await _async_redis_client.connection_pool.disconnect()
+    if _redis_client is not None:
+        _redis_client.close()
+    _redis_client = None
+    _async_redis_client = None
 
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
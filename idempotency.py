@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import orjson
+import redis
+
+from database import get_async_redis_client
+from metrics import track_redis
+
+logger = logging.getLogger(__name__)
+
+# تنظیمات کلیدهای Idempotency-Key
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+# مهلت ثبت حالت «در حال اجرا»؛ اگر worker از کار بیفتد پس از این مدت کلید آزاد می‌شود
+IDEMPOTENCY_PENDING_TTL = int(os.getenv("IDEMPOTENCY_PENDING_TTL", "120"))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "60"))
+IDEMPOTENCY_POLL_INTERVAL = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL", "0.25"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# اجراهای در جریان این worker؛ درخواست تکراری بدون polling به همان اجرا متصل می‌شود
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+class IdempotencyError(Exception):
+    """استفاده نادرست یا هم‌زمان از یک Idempotency-Key"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def request_fingerprint(payload) -> str:
+    """اثر انگشت بدنه درخواست؛ یک کلید نباید با بدنه متفاوت دوباره استفاده شود"""
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def _redis_key(scope: str, idempotency_key: str) -> str:
+    return f"idempotency:{scope}:{idempotency_key}"
+
+
+async def _read(key: str) -> Optional[dict]:
+    with track_redis("idempotency_read"):
+        raw = await get_async_redis_client().get(key)
+    return orjson.loads(raw) if raw is not None else None
+
+
+def _replay(record: dict, fingerprint: str) -> Optional[dict]:
+    """پاسخ ذخیره‌شده در صورت تکمیل اجرا"""
+    if record["fingerprint"] != fingerprint:
+        raise IdempotencyError(422, "Idempotency-Key با بدنه متفاوتی استفاده شده است")
+    if record["state"] == "done":
+        return record["response"]
+    return None
+
+
+async def _wait_for_other_worker(key: str, fingerprint: str) -> dict:
+    """انتظار برای نتیجه اجرایی که worker دیگری شروع کرده است"""
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+        record = await _read(key)
+        if record is None:
+            # اجرای اول ناموفق بود و کلید آزاد شد
+            raise IdempotencyError(409, "درخواست قبلی با این کلید ناموفق بود. لطفاً دوباره تلاش کنید.", 1)
+        response = _replay(record, fingerprint)
+        if response is not None:
+            return response
+    raise IdempotencyError(409, "درخواستی با این کلید هنوز در حال پردازش است", IDEMPOTENCY_POLL_INTERVAL * 4)
+
+
+async def run_idempotent(
+    scope: str,
+    idempotency_key: str,
+    fingerprint: str,
+    compute: Callable[[], Awaitable[dict]],
+) -> Tuple[dict, bool]:
+    """اجرای یک‌باره compute برای هر کلید؛ خروجی (پاسخ، تکراری بودن)"""
+    if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise IdempotencyError(400, "Idempotency-Key نامعتبر است")
+
+    key = _redis_key(scope, idempotency_key)
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        response, owner_fingerprint = await asyncio.shield(inflight)
+        if owner_fingerprint != fingerprint:
+            raise IdempotencyError(422, "Idempotency-Key با بدنه متفاوتی استفاده شده است")
+        return response, True
+
+    pending = orjson.dumps({"state": "pending", "fingerprint": fingerprint})
+    try:
+        with track_redis("idempotency_claim"):
+            claimed = await get_async_redis_client().set(key, pending, nx=True, ex=IDEMPOTENCY_PENDING_TTL)
+        if not claimed:
+            record = await _read(key)
+            if record is not None:
+                response = _replay(record, fingerprint)
+                if response is None:
+                    response = await _wait_for_other_worker(key, fingerprint)
+                return response, True
+    except redis.RedisError as e:
+        # بدون Redis تضمین یک‌باره بودن ممکن نیست، ولی درخواست نباید رد شود
+        logger.warning(f"خطا در بررسی Idempotency-Key: {e}")
+        return await compute(), False
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        response = await compute()
+    except BaseException as e:
+        # اجرای ناموفق ذخیره نمی‌شود تا تلاش بعدی کلاینت دوباره اجرا شود
+        try:
+            with track_redis("idempotency_release"):
+                await get_async_redis_client().delete(key)
+        except redis.RedisError as redis_error:
+            logger.warning(f"خطا در آزادسازی Idempotency-Key: {redis_error}")
+        if isinstance(e, Exception):
+            future.set_exception(e)
+            future.exception()
+        else:
+            future.cancel()
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+    future.set_result((response, fingerprint))
+    record = orjson.dumps({"state": "done", "fingerprint": fingerprint, "response": response})
+    try:
+        with track_redis("idempotency_store"):
+            await get_async_redis_client().set(key, record, ex=IDEMPOTENCY_TTL)
+    except redis.RedisError as e:
+        logger.warning(f"خطا در ذخیره پاسخ Idempotency-Key: {e}")
+    return response, False
@@ -0,0 +1,146 @@
+import logging
+import os
+import secrets
+import threading
+import time
+import uuid
+
+from sqlalchemy import LargeBinary, String, inspect, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import TypeDecorator
+
+logger = logging.getLogger(__name__)
+
+# uuid7: شناسه‌های مرتب بر اساس زمان برای درج متوالی در ایندکس؛ uuid4: رفتار قدیمی
+ID_SCHEME = os.getenv("ID_SCHEME", "uuid7")
+# string: ستون VARCHAR(36) فعلی؛ native: نوع uuid در PostgreSQL و ۱۶ بایت باینری در سایر دیتابیس‌ها
+ID_STORAGE = os.getenv("ID_STORAGE", "string")
+ID_MIGRATION_BATCH_SIZE = int(os.getenv("ID_MIGRATION_BATCH_SIZE", "1000"))
+
+
+_last_ms = 0
+_sequence = 0
+# thread‌های SessionLocal همگام، executorها و خروجی ML هم‌زمان شناسه می‌سازند
+_state_lock = threading.Lock()
+
+
+def uuid7() -> uuid.UUID:
+    """UUID نسخه ۷ (RFC 9562): ۴۸ بیت میلی‌ثانیه یونیکس، شمارنده ۱۲ بیتی و ۶۲ بیت تصادفی"""
+    global _last_ms, _sequence
+    with _state_lock:
+        ms = time.time_ns() // 1_000_000
+        if ms > _last_ms:
+            _last_ms, _sequence = ms, secrets.randbits(11)
+        else:
+            # چند شناسه در یک میلی‌ثانیه: شمارنده ترتیب را حفظ می‌کند
+            _sequence += 1
+            if _sequence > 0xFFF:
+                _last_ms, _sequence = _last_ms + 1, 0
+        timestamp, sequence = _last_ms, _sequence
+    return uuid.UUID(int=(
+        timestamp << 80 | 0x7 << 76 | sequence << 64 | 0x2 << 62 | secrets.randbits(62)
+    ))
+
+
+def new_id() -> str:
+    """شناسه جدید ردیف بر اساس ID_SCHEME"""
+    return str(uuid7() if ID_SCHEME == "uuid7" else uuid.uuid4())
+
+
+class CompactUUID(TypeDecorator):
+    """شناسه UUID که در کد همیشه رشته است و در دیتابیس بسته به ID_STORAGE فشرده ذخیره می‌شود"""
+
+    impl = String(36)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if ID_STORAGE != "native":
+            return dialect.type_descriptor(String(36))
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or ID_STORAGE != "native" or dialect.name == "postgresql" or isinstance(value, bytes):
+            return value
+        return uuid.UUID(str(value)).bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return str(uuid.UUID(bytes=bytes(value)))
+        return str(value)
+
+
+def _id_columns(metadata):
+    """ستون‌های CompactUUID هر جدول به ترتیب وابستگی جدول‌ها"""
+    for table in metadata.sorted_tables:
+        columns = [column.name for column in table.columns if isinstance(column.type, CompactUUID)]
+        if columns:
+            yield table, columns
+
+
+def migrate_id_storage(connection, metadata):
+    """تبدیل ستون‌های شناسه موجود از VARCHAR(36) به ذخیره‌سازی native (اجرا درون run_sync یا begin)"""
+    if ID_STORAGE != "native":
+        raise RuntimeError("set ID_STORAGE=native before migrating id columns")
+
+    if connection.dialect.name == "postgresql":
+        # کلیدهای خارجی بین ستون‌های شناسه باید هنگام تغییر نوع هر دو طرف برداشته شوند
+        inspector = inspect(connection)
+        id_tables = {table.name for table, _ in _id_columns(metadata)}
+        foreign_keys = [
+            (table_name, fk) for table_name in id_tables
+            for fk in inspector.get_foreign_keys(table_name) if fk["referred_table"] in id_tables
+        ]
+        for table_name, fk in foreign_keys:
+            connection.execute(text(f'ALTER TABLE {table_name} DROP CONSTRAINT "{fk["name"]}"'))
+        for table, columns in _id_columns(metadata):
+            for column in columns:
+                connection.execute(text(
+                    f"ALTER TABLE {table.name} ALTER COLUMN {column} TYPE uuid USING {column}::uuid"
+                ))
+        for table_name, fk in foreign_keys:
+            connection.execute(text(
+                f'ALTER TABLE {table_name} ADD CONSTRAINT "{fk["name"]}" '
+                f'FOREIGN KEY ({", ".join(fk["constrained_columns"])}) '
+                f'REFERENCES {fk["referred_table"]} ({", ".join(fk["referred_columns"])})'
+            ))
+        return
+
+    # SQLite و سایر دیتابیس‌ها تغییر نوع ستون ندارند؛ جدول‌ها بازسازی و ردیف‌ها دسته‌ای کپی می‌شوند
+    tables = [table for table, _ in _id_columns(metadata)]
+    existing = set(inspect(connection).get_table_names())
+    tables = [table for table in tables if table.name in existing]
+    for table in tables:
+        for index in table.indexes:
+            connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        connection.execute(text(f"ALTER TABLE {table.name} RENAME TO {table.name}_old"))
+    for table in tables:
+        table.create(bind=connection)
+        old_columns = {column["name"] for column in inspect(connection).get_columns(f"{table.name}_old")}
+        columns = [column for column in table.columns if column.name in old_columns]
+        names = ", ".join(column.name for column in columns)
+        # ستون‌های شناسه قدیمی رشته‌اند؛ بقیه با نوع مدل خوانده می‌شوند تا مثلاً تاریخ‌ها درست تبدیل شوند
+        query = text(f"SELECT {names} FROM {table.name}_old").columns(**{
+            column.name: String(36) if isinstance(column.type, CompactUUID) else column.type for column in columns
+        })
+        rows = connection.execute(query).yield_per(ID_MIGRATION_BATCH_SIZE)
+        for batch in rows.partitions():
+            connection.execute(table.insert(), [dict(zip([c.name for c in columns], row)) for row in batch])
+        logger.info(f"ستون‌های شناسه جدول {table.name} به ذخیره‌سازی باینری منتقل شد")
+    for table in reversed(tables):
+        connection.execute(text(f"DROP TABLE {table.name}_old"))
+
+
+if __name__ == "__main__":
+    from database import engine
+    from models import Base
+    # مدل‌ها از ماژول ids استفاده می‌کنند نه __main__؛ بررسی نوع ستون‌ها باید با همان کلاس انجام شود
+    import ids
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with engine.begin() as connection:
+        ids.migrate_id_storage(connection, Base.metadata)
+    print(f"✅ id columns migrated to {ID_STORAGE} storage")
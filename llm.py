@@ -0,0 +1,301 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, TypeVar
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+from metrics import track_llm, LLM_TIME_TO_FIRST_TOKEN
+
+logger = logging.getLogger(__name__)
+
+# تنظیمات مدل زبانی
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "2000"))
+
+# تنظیمات استخر اتصال HTTP مشترک
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "500"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "100"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+
+# تنظیمات تاب‌آوری فراخوانی‌ها
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "45"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_RETRY_MAX_WAIT = float(os.getenv("LLM_RETRY_MAX_WAIT", "8"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0") == "1"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "50"))
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_RESET_TIMEOUT = float(os.getenv("LLM_BREAKER_RESET_TIMEOUT", "30"))
+
+# خطاهای گذرا که تکرار درخواست برایشان معنا دارد
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+T = TypeVar("T")
+
+# با هر تغییر در متن پرامپت افزایش یابد تا کش تحلیل‌ها باطل شود
+MBTI_PROMPT_VERSION = 1
+
+MBTI_SYSTEM_PROMPT = "شما یک متخصص تحلیل شخصیت MBTI هستید. تحلیل‌های شما باید دقیق، علمی و به زبان فارسی باشد."
+
+MBTI_USER_PROMPT = """لطفاً یک تحلیل دقیق و جامع از تیپ شخصیتی {mbti_type} ارائه دهید. تحلیل باید شامل موارد زیر باشد:
+
+1. نقاط قوت: ویژگی‌های مثبت و توانمندی‌های این تیپ شخصیتی
+2. نقاط ضعف: محدودیت‌ها و چالش‌های احتمالی
+3. ویژگی‌های کلی: خصوصیات اصلی و سبک زندگی
+4. مشاغل مناسب: حرفه‌هایی که با این تیپ شخصیتی سازگار هستند
+5. روابط: نحوه تعامل با دیگران و ویژگی‌های روابط
+6. سبک یادگیری: روش‌های موثر یادگیری
+7. راه‌های رشد و توسعه: پیشنهاداتی برای بهبود و توسعه شخصی
+
+لطفاً تحلیل را به صورت ساختاریافته و با جزئیات کافی ارائه دهید."""
+
+_http_client: Optional[httpx.AsyncClient] = None
+_client: Optional[AsyncOpenAI] = None
+
+
+class LLMUnavailableError(Exception):
+    """سرویس بالادستی در دسترس نیست (مدار باز یا تلاش‌ها تمام شده)"""
+
+
+class CircuitBreaker:
+    """قطع‌کننده مدار: پس از چند خطای پیاپی برای مدتی فراخوانی‌ها را متوقف می‌کند"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def is_open(self) -> bool:
+        """بررسی وضعیت بدون مصرف فرصت آزمایشی نیمه‌باز"""
+        return self.state == "open" or (self.state == "half_open" and self._trial_in_flight)
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            # فقط یک درخواست آزمایشی تا مشخص شدن سلامت سرویس
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._trial_in_flight:
+                logger.warning("مدار فراخوانی مدل زبانی باز شد")
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+
+class LatencyTracker:
+    """نگهداری تأخیر فراخوانی‌های موفق اخیر برای محاسبه صدک"""
+
+    def __init__(self, size: int = 500):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        if len(self.samples) < min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+llm_circuit = CircuitBreaker(LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_RESET_TIMEOUT)
+llm_latency = LatencyTracker()
+
+
+def build_mbti_messages(mbti_type: str) -> List[dict]:
+    """ساخت پیام‌های درخواست تحلیل MBTI"""
+    return [
+        {"role": "system", "content": MBTI_SYSTEM_PROMPT},
+        {"role": "user", "content": MBTI_USER_PROMPT.format(mbti_type=mbti_type)},
+    ]
+
+
+def llm_configured() -> bool:
+    """آیا کلید API برای فراخوانی مدل تنظیم شده است"""
+    return bool(OPENAI_API_KEY)
+
+
+def init_llm_client() -> AsyncOpenAI:
+    """ایجاد کلاینت ناهمگام OpenAI روی یک استخر اتصال مشترک"""
+    global _http_client, _client
+    if _client is not None:
+        return _client
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+
+    _http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+    # تکرار درخواست‌ها را resilient_call انجام می‌دهد، نه خود SDK
+    _client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=_http_client, max_retries=0)
+    logger.info("OpenAI async client initialized successfully")
+    return _client
+
+
+async def close_llm_client():
+    """بستن کلاینت و آزادسازی اتصال‌های استخر"""
+    global _http_client, _client
+    if _client is not None:
+        await _client.close()
+    elif _http_client is not None:
+        await _http_client.aclose()
+    _client = None
+    _http_client = None
+
+
+def get_llm_client() -> AsyncOpenAI:
+    """دریافت کلاینت مشترک OpenAI؛ در اولین فراخوانی ساخته می‌شود"""
+    if _client is None:
+        return init_llm_client()
+    return _client
+
+
+async def _hedged(call: Callable[[], Awaitable[T]], hedge_delay: Optional[float], timeout: float) -> T:
+    """اجرای یک تلاش؛ اگر تا hedge_delay پاسخی نیامد درخواست دوم موازی ارسال و اولین پاسخ استفاده می‌شود"""
+    if hedge_delay is None or hedge_delay >= timeout:
+        return await asyncio.wait_for(call(), timeout)
+
+    deadline = time.monotonic() + timeout
+    tasks = [asyncio.ensure_future(call())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+        if not done:
+            tasks.append(asyncio.ensure_future(call()))
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+            # اگر هر دو درخواست خطا دادند، خطای آخری برگردانده می‌شود
+            tasks = [task for task in tasks if not task.done()]
+            if not tasks:
+                raise done.pop().exception()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def resilient_call(call: Callable[[], Awaitable[T]], deadline: float = LLM_DEADLINE) -> T:
+    """فراخوانی با مهلت کلی، تکرار با backoff تصادفی روی خطاهای گذرا، hedging اختیاری و قطع‌کننده مدار"""
+    deadline_at = time.monotonic() + deadline
+    hedge_delay = None
+    if LLM_HEDGE_ENABLED:
+        hedge_delay = llm_latency.percentile(LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES)
+
+    try:
+        async for attempt in AsyncRetrying(
+            retry=retry_if_exception_type(RETRYABLE_ERRORS),
+            wait=wait_random_exponential(multiplier=0.5, max=LLM_RETRY_MAX_WAIT),
+            stop=stop_after_attempt(LLM_MAX_ATTEMPTS),
+            reraise=True,
+        ):
+            with attempt:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    raise LLMUnavailableError("LLM deadline exceeded")
+                if not llm_circuit.allow():
+                    raise LLMUnavailableError("LLM circuit is open")
+
+                started = time.monotonic()
+                try:
+                    result = await _hedged(call, hedge_delay, remaining)
+                except RETRYABLE_ERRORS:
+                    llm_circuit.record_failure()
+                    raise
+                except Exception:
+                    # خطاهای غیرگذرا (مثلاً درخواست نامعتبر) نشانه ناسالمی سرویس نیستند
+                    llm_circuit.record_success()
+                    raise
+                llm_circuit.record_success()
+                llm_latency.record(time.monotonic() - started)
+                return result
+    except RETRYABLE_ERRORS as e:
+        raise LLMUnavailableError(f"LLM call failed after retries: {e}") from e
+
+
+async def generate_mbti_analysis(mbti_type: str) -> str:
+    """تولید تحلیل MBTI بدون مسدود کردن event loop"""
+    async def call():
+        with track_llm("chat"):
+            response = await get_llm_client().chat.completions.create(
+                model=LLM_MODEL,
+                messages=build_mbti_messages(mbti_type),
+                temperature=LLM_TEMPERATURE,
+                max_tokens=LLM_MAX_TOKENS,
+            )
+        return response.choices[0].message.content
+
+    return await resilient_call(call)
+
+
+async def stream_mbti_analysis(mbti_type: str) -> AsyncIterator[str]:
+    """تولید تحلیل MBTI به صورت جریانی؛ هر بخش متن به محض دریافت برگردانده می‌شود"""
+    with track_llm("chat_stream"):
+        started = time.perf_counter()
+        first_token = True
+        try:
+            # پس از ارسال اولین بخش تکرار ممکن نیست؛ فقط شروع جریان با تکرار و مهلت انجام می‌شود
+            stream = await resilient_call(lambda: get_llm_client().chat.completions.create(
+                model=LLM_MODEL,
+                messages=build_mbti_messages(mbti_type),
+                temperature=LLM_TEMPERATURE,
+                max_tokens=LLM_MAX_TOKENS,
+                stream=True,
+            ))
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token:
+                            LLM_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started)
+                            first_token = False
+                        yield chunk.choices[0].delta.content
+            finally:
+                # با قطع کلاینت یا لغو، اتصال httpx بدون انتظار برای پایان پاسخ بالادستی به pool برمی‌گردد
+                await stream.close()
+        except RETRYABLE_ERRORS:
+            llm_circuit.record_failure()
+            raise
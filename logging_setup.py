@@ -0,0 +1,115 @@
+import atexit
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from metrics import LOG_RECORDS_DROPPED
+
+# تنظیمات لاگینگ
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "%(asctime)s - %(levelname)s - %(message)s")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# نسبت لاگ‌های INFO و پایین‌تر که نگه داشته می‌شوند؛ هشدارها و خطاها همیشه ثبت می‌شوند
+LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0"))
+# loggerهای uvicorn هندلر همگام خود را دارند؛ به root و صف آن هدایت می‌شوند
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+
+class SamplingFilter(logging.Filter):
+    """نمونه‌برداری از لاگ‌های پرحجم سطح INFO و پایین‌تر"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.INFO or self.rate >= 1 or random.random() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """افزودن رکورد به صف محدود بدون انتظار؛ در صورت پر بودن صف رکورد دور ریخته و شمرده می‌شود"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # قالب‌بندی (به‌خصوص traceback) به thread شنونده سپرده می‌شود؛ اینجا فقط پیام ثابت می‌شود
+        # تا آرگومان‌های قابل تغییر پس از بازگشت از فراخوانی لاگ عوض نشوند
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+            return
+        if self.dropped:
+            self._report_dropped()
+
+    def _report_dropped(self):
+        """گزارش تعداد رکوردهای دورریخته پس از خالی شدن جا در صف"""
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if not dropped:
+            return
+        notice = logging.LogRecord(
+            __name__, logging.WARNING, __file__, 0, f"{dropped} رکورد لاگ به دلیل پر بودن صف دور ریخته شد", None, None
+        )
+        try:
+            self.queue.put_nowait(notice)
+        except queue.Full:
+            with self._lock:
+                self.dropped += dropped
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging() -> QueueListener:
+    """پیکربندی root logger با صف؛ نوشتن روی stdout در thread جداگانه انجام می‌شود"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_INFO_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    for name in UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        for handler in list(uvicorn_logger.handlers):
+            uvicorn_logger.removeHandler(handler)
+        uvicorn_logger.propagate = True
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # رکوردهای باقی‌مانده در صف هنگام خروج نوشته می‌شوند
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging():
+    """توقف شنونده پس از نوشتن همه رکوردهای صف"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,47 +1,100 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi.responses import StreamingResponse, ORJSONResponse, Response
+from starlette.background import BackgroundTask
+from sqlalchemy import delete, select, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 import logging
-from datetime import timedelta
-from pydantic import BaseModel
+import base64
+import math
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from pydantic import BaseModel, Field, field_validator
 import os
+import orjson
 from dotenv import load_dotenv
-from openai import OpenAI
-import traceback
 
-from database import get_db, engine
-from models import Base, User, TestResult
+from database import get_async_db, async_engine, AsyncSessionLocal, get_async_redis_client, close_redis_clients
+from models import Base, User, TestResult, AnalysisBlob
 from auth import (
-    generate_otp, store_otp, verify_otp,
+    generate_otp, store_otp, verify_otp, check_otp_send_limit,
     create_access_token, get_current_user,
+    CurrentUser, principal_cache, invalidate_user, listen_for_user_invalidations,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
-
-# ایجاد جداول دیتابیس
-Base.metadata.create_all(bind=engine)
-
-# تنظیمات لاگینگ
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+from llm import (
+    llm_configured, close_llm_client,
+    generate_mbti_analysis, stream_mbti_analysis, MBTI_PROMPT_VERSION,
+    LLMUnavailableError, llm_circuit, LLM_BREAKER_RESET_TIMEOUT
 )
+from admission import llm_admission, AdmissionRejected, is_priority_user
+from compression import CompressionMiddleware
+from metrics import MetricsMiddleware, instrument_engine, render_metrics
+from analysis_store import store_analysis, decode_analysis, migrate_schema
+from bulk_ingest import ingest_test_results, iter_ndjson, iter_json_array, NDJSON_CONTENT_TYPES, BULK_INGEST_BATCH_SIZE
+from result_versions import get_results_version, bump_results_version, make_etag, etag_matches
+from logging_setup import setup_logging
+from idempotency import run_idempotent, request_fingerprint, IdempotencyError
+from analysis_cache import get_or_generate, stream_or_generate, get_cached_variant, get_fallback_analysis, cache_key
+
 logger = logging.getLogger(__name__)
 
-# تنظیم API Key
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    logger.error("❌ API Key یافت نشد!")
-    raise ValueError("API Key الزامی است")
+# ابطال کش کاربران از طریق Redis
+PRINCIPAL_INVALIDATION_ENABLED = os.getenv("PRINCIPAL_INVALIDATION_ENABLED", "1") == "1"
+READINESS_CHECK_TIMEOUT = float(os.getenv("READINESS_CHECK_TIMEOUT", "1"))
+
+# زمان‌بندی مراحل راه‌اندازی (میلی‌ثانیه) برای /health/startup
+startup_timings = {"import_ms": round((time.perf_counter() - _IMPORT_STARTED) * 1000, 2)}
+
+async def ensure_schema():
+    """ایجاد جداول، ستون‌ها و ایندکس‌های ناموجود؛ وقتی چیزی برای تغییر نباشد چند میلی‌ثانیه طول می‌کشد"""
+    started = time.perf_counter()
+
+    def create(connection):
+        Base.metadata.create_all(bind=connection)
+        migrate_schema(connection)
+        # create_all روی جداول موجود ایندکس جدید نمی‌سازد
+        for index in TestResult.__table__.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+    async with async_engine.begin() as connection:
+        await connection.run_sync(create)
+    startup_timings["schema_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(f"بررسی شمای دیتابیس در {startup_timings['schema_ms']} میلی‌ثانیه انجام شد")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """راه‌اندازی و خاموش‌سازی worker؛ منابع سنگین به صورت تنبل ساخته می‌شوند"""
+    started = time.perf_counter()
+    # تنظیمات لاگینگ: نوشتن لاگ‌ها در thread جداگانه تا event loop مسدود نشود؛
+    # thread شنونده فقط در worker ساخته می‌شود، نه با هر import این ماژول
+    setup_logging()
+    # تنظیم API Key
+    if not llm_configured():
+        logger.error("❌ API Key یافت نشد! درخواست‌های تحلیل تا تنظیم OPENAI_API_KEY ناموفق خواهند بود")
+    app.state.schema_task = asyncio.create_task(ensure_schema())
+    # مسیرهای دیتابیس پیش از افزودن ستون‌های جدید به جدول‌های قدیمی نباید درخواست بپذیرند
+    await app.state.schema_task
+    if PRINCIPAL_INVALIDATION_ENABLED:
+        app.state.invalidation_listener = asyncio.create_task(listen_for_user_invalidations())
+    startup_timings["lifespan_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    startup_timings["ready_to_serve_ms"] = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 2)
 
-logger.info(f"🎯 API Key موجود: {'بله' if OPENAI_API_KEY else 'خیر'}")
-logger.info(f"🎯 طول API Key: {len(OPENAI_API_KEY) if OPENAI_API_KEY else 0}")
-logger.info(f"🎯 پیشوند API Key: {OPENAI_API_KEY[:10]}...")
+    yield
 
-client = OpenAI(api_key=OPENAI_API_KEY)
-logger.info("OpenAI client initialized successfully")
+    for task in (app.state.schema_task, getattr(app.state, "invalidation_listener", None)):
+        if task is not None and not task.done():
+            task.cancel()
+    await close_llm_client()
+    await close_redis_clients()
+    await async_engine.dispose()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # تنظیمات CORS
 app.add_middleware(
@@ -52,6 +105,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# فشرده‌سازی پاسخ‌های بزرگ (متن‌های طولانی تحلیل) بر اساس Accept-Encoding
+app.add_middleware(CompressionMiddleware)
+# بیرونی‌ترین لایه تا زمان کل پردازش درخواست اندازه‌گیری شود
+app.add_middleware(MetricsMiddleware)
+instrument_engine(async_engine)
+
 # مدل‌های Pydantic
 class PhoneNumber(BaseModel):
     phone: str
@@ -65,23 +124,76 @@ class Token(BaseModel):
     token_type: str
 
 class TestResultCreate(BaseModel):
+    test_type: str = Field(min_length=1, max_length=50)
+    mbti_type: str = Field(min_length=1, max_length=4)
+    analysis: str = Field(min_length=1)
+    created_at: Optional[datetime] = None
+
+    @field_validator("created_at")
+    @classmethod
+    def created_at_to_utc(cls, value: Optional[datetime]) -> Optional[datetime]:
+        """ستون created_at بدون منطقه زمانی و به وقت UTC است؛ زمان‌های دارای offset تبدیل می‌شوند"""
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+class TestResultResponse(BaseModel):
+    id: str
     test_type: str
     mbti_type: str
     analysis: str
+    created_at: datetime
 
-class TestResultResponse(BaseModel):
+class TestResultSummary(BaseModel):
     id: str
     test_type: str
     mbti_type: str
-    analysis: str
-    created_at: str
+    created_at: datetime
+    analysis: Optional[str] = None
+
+class TestResultPage(BaseModel):
+    items: List[TestResultSummary]
+    next_cursor: Optional[str] = None
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """پاسخ 429 سریع هنگام اشباع ظرفیت فراخوانی مدل زبانی"""
+    return ORJSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "سرویس تحلیل در حال حاضر شلوغ است. لطفاً کمی بعد دوباره تلاش کنید."},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
+@app.exception_handler(LLMUnavailableError)
+async def llm_unavailable_handler(request: Request, exc: LLMUnavailableError):
+    """پاسخ 503 وقتی مدل در دسترس نیست و تحلیل جایگزینی هم وجود ندارد"""
+    return ORJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "سرویس تحلیل موقتاً در دسترس نیست. لطفاً کمی بعد دوباره تلاش کنید."},
+        headers={"Retry-After": str(math.ceil(LLM_BREAKER_RESET_TIMEOUT))}
+    )
+
+@app.exception_handler(IdempotencyError)
+async def idempotency_error_handler(request: Request, exc: IdempotencyError):
+    """کلید نامعتبر، استفاده با بدنه متفاوت یا درخواست هم‌زمان هنوز در حال اجرا"""
+    headers = {"Retry-After": str(math.ceil(exc.retry_after))} if exc.retry_after else None
+    return ORJSONResponse(status_code=exc.status_code, content={"detail": exc.detail}, headers=headers)
 
 # API‌های احراز هویت
 @app.post("/auth/send-otp")
-async def send_otp(phone_data: PhoneNumber):
+async def send_otp(phone_data: PhoneNumber, request: Request):
     """ارسال کد OTP به شماره موبایل"""
+    client_ip = request.client.host if request.client else None
+    retry_after = await check_otp_send_limit(phone_data.phone, client_ip)
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="تعداد درخواست‌های ارسال کد بیش از حد مجاز است. لطفاً بعداً تلاش کنید.",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
     otp = generate_otp()
-    store_otp(phone_data.phone, otp)
+    await store_otp(phone_data.phone, otp)
     
     # در محیط واقعی، اینجا کد را از طریق سرویس پیامک ارسال می‌کنیم
     logger.info(f"OTP for {phone_data.phone}: {otp}")
@@ -89,22 +201,22 @@ async def send_otp(phone_data: PhoneNumber):
     return {"message": "کد تایید ارسال شد"}
 
 @app.post("/auth/verify-otp", response_model=Token)
-async def verify_otp_endpoint(otp_data: OTPVerify, db: Session = Depends(get_db)):
+async def verify_otp_endpoint(otp_data: OTPVerify, db: AsyncSession = Depends(get_async_db)):
     """تایید کد OTP و صدور توکن"""
-    if not verify_otp(otp_data.phone, otp_data.otp):
+    if not await verify_otp(otp_data.phone, otp_data.otp):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="کد تایید نامعتبر است"
         )
     
     # بررسی وجود کاربر
-    user = db.query(User).filter(User.phone == otp_data.phone).first()
+    user = (await db.execute(select(User).where(User.phone == otp_data.phone))).scalar_one_or_none()
     if not user:
         # ایجاد کاربر جدید
         user = User(phone=otp_data.phone)
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
     
     # ایجاد توکن
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -112,13 +224,47 @@ async def verify_otp_endpoint(otp_data: OTPVerify, db: Session = Depends(get_db)
         data={"sub": user.id},
         expires_delta=access_token_expires
     )
+    principal_cache.set(
+        access_token, CurrentUser.from_user(user),
+        time.time() + access_token_expires.total_seconds()
+    )
     
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.delete("/auth/me", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_account(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """حذف حساب کاربر و نتایج تست‌های او؛ توکن‌های کش‌شده در همه workerها باطل می‌شوند"""
+    await db.execute(delete(TestResult).where(TestResult.user_id == current_user.id))
+    await db.execute(delete(User).where(User.id == current_user.id))
+    await db.commit()
+    await invalidate_user(current_user.id)
+    await bump_results_version(current_user.id)
+    logger.info(f"حساب کاربر {current_user.id} حذف شد")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
 # API‌های تست
 @app.post("/analyze")
-async def analyze_mbti(mbti_data: dict, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    """تحلیل تیپ شخصیتی MBTI"""
+async def analyze_mbti(
+    mbti_data: dict,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """تحلیل تیپ شخصیتی MBTI؛ با هدر Idempotency-Key تکرار درخواست تحلیل و ذخیره دوباره ندارد"""
+    idempotency_key = request.headers.get("idempotency-key")
+    if idempotency_key is None:
+        return await _analyze_mbti(mbti_data, db, current_user)
+
+    response, replayed = await run_idempotent(
+        f"analyze:{current_user.id}", idempotency_key, request_fingerprint(mbti_data),
+        lambda: _analyze_mbti(mbti_data, db, current_user)
+    )
+    return ORJSONResponse(response, headers={"Idempotent-Replayed": "true"} if replayed else None)
+
+async def _analyze_mbti(mbti_data: dict, db: AsyncSession, current_user: CurrentUser) -> dict:
     try:
         mbti_type = mbti_data.get("mbti_type")
         if not mbti_type:
@@ -126,28 +272,18 @@ async def analyze_mbti(mbti_data: dict, db: Session = Depends(get_db), current_u
 
         logger.info(f"درخواست تحلیل برای تیپ شخصیتی: {mbti_type}")
 
-        # ارسال درخواست به OpenAI
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "شما یک متخصص تحلیل شخصیت MBTI هستید. تحلیل‌های شما باید دقیق، علمی و به زبان فارسی باشد."},
-                {"role": "user", "content": f"""لطفاً یک تحلیل دقیق و جامع از تیپ شخصیتی {mbti_type} ارائه دهید. تحلیل باید شامل موارد زیر باشد:
-
-1. نقاط قوت: ویژگی‌های مثبت و توانمندی‌های این تیپ شخصیتی
-2. نقاط ضعف: محدودیت‌ها و چالش‌های احتمالی
-3. ویژگی‌های کلی: خصوصیات اصلی و سبک زندگی
-4. مشاغل مناسب: حرفه‌هایی که با این تیپ شخصیتی سازگار هستند
-5. روابط: نحوه تعامل با دیگران و ویژگی‌های روابط
-6. سبک یادگیری: روش‌های موثر یادگیری
-7. راه‌های رشد و توسعه: پیشنهاداتی برای بهبود و توسعه شخصی
-
-لطفاً تحلیل را به صورت ساختاریافته و با جزئیات کافی ارائه دهید."""}
-            ],
-            temperature=0.7,
-            max_tokens=2000
-        )
+        async def generate():
+            async with llm_admission.admit(current_user.id, is_priority_user(current_user.plan)):
+                return await generate_mbti_analysis(mbti_type)
 
-        analysis = response.choices[0].message.content
+        # دریافت تحلیل از کش یا ارسال درخواست به OpenAI
+        try:
+            analysis = await get_or_generate("MBTI", mbti_type, MBTI_PROMPT_VERSION, generate)
+        except LLMUnavailableError as e:
+            analysis = await get_fallback_analysis("MBTI", mbti_type, MBTI_PROMPT_VERSION)
+            if analysis is None:
+                raise
+            logger.warning(f"مدل در دسترس نیست، تحلیل جایگزین استفاده شد: {e}")
         logger.info(f"تحلیل با موفقیت تولید شد. طول متن: {len(analysis)} کاراکتر")
 
         # ذخیره نتیجه در دیتابیس
@@ -155,25 +291,269 @@ async def analyze_mbti(mbti_data: dict, db: Session = Depends(get_db), current_u
             user_id=current_user.id,
             test_type="MBTI",
             mbti_type=mbti_type,
-            analysis=analysis
+            analysis_hash=await store_analysis(db, analysis)
         )
         db.add(test_result)
-        db.commit()
-        db.refresh(test_result)
+        await db.commit()
+        await bump_results_version(current_user.id)
 
         return {"analysis": analysis}
 
+    except (HTTPException, AdmissionRejected, LLMUnavailableError):
+        raise
     except Exception as e:
-        logger.error(f"خطا در تحلیل شخصیت: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"خطا در تحلیل شخصیت: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail="متأسفانه در تحلیل شخصیت شما مشکلی پیش آمده است. لطفاً دوباره تلاش کنید."
         )
 
+@app.post("/test-results/bulk")
+async def bulk_create_test_results(
+    request: Request,
+    batch_size: int = Query(BULK_INGEST_BATCH_SIZE, ge=1, le=5000),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """ورود گروهی نتایج تست از NDJSON یا آرایه JSON؛ خطای هر ردیف جداگانه گزارش می‌شود"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    parser = iter_ndjson if content_type in NDJSON_CONTENT_TYPES else iter_json_array
+    report = await ingest_test_results(
+        db, current_user.id, parser(request.stream()), TestResultCreate, batch_size
+    )
+    if report.inserted:
+        await bump_results_version(current_user.id)
+    logger.info(f"ورود گروهی نتایج: {report.inserted} ذخیره شد، {report.failed} ناموفق")
+    return report.as_dict()
+
 # API‌های داشبورد
+async def _not_modified(request: Request, response: Response, user_id: str, *variant: str) -> Optional[Response]:
+    """پاسخ 304 اگر نسخه نتایج کاربر تغییر نکرده باشد؛ در غیر این صورت ETag روی پاسخ تنظیم می‌شود"""
+    # نسخه پیش از کوئری خوانده می‌شود تا نوشتن هم‌زمان حداکثر باعث یک درخواست کامل اضافه شود
+    version = await get_results_version(user_id)
+    if version is None:
+        return None
+    etag = make_etag(version, user_id, request.url.path, *variant)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
+
 @app.get("/dashboard/test-results", response_model=List[TestResultResponse])
-async def get_test_results(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_test_results(
+    request: Request,
+    response: Response,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
     """دریافت لیست نتایج تست‌های کاربر"""
-    results = db.query(TestResult).filter(TestResult.user_id == current_user.id).all()
-    return results 
\ No newline at end of file
+    not_modified = await _not_modified(request, response, current_user.id)
+    if not_modified is not None:
+        return not_modified
+    results = await db.execute(select(TestResult).where(TestResult.user_id == current_user.id))
+    return results.scalars().all()
+
+def _encode_cursor(created_at: datetime, result_id: str) -> str:
+    """ساخت cursor صفحه‌بندی از (created_at, id) آخرین ردیف"""
+    raw = f"{created_at.isoformat()}|{result_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str):
+    """بازکردن cursor صفحه‌بندی"""
+    try:
+        created_at, result_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), result_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="cursor نامعتبر است")
+
+@app.get("/dashboard/results", response_model=TestResultPage)
+async def get_test_results_page(
+    request: Request,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    include_analysis: bool = False,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """دریافت صفحه‌ای نتایج تست‌های کاربر، از جدیدترین به قدیمی‌ترین"""
+    not_modified = await _not_modified(
+        request, response, current_user.id, str(limit), cursor or "", str(include_analysis)
+    )
+    if not_modified is not None:
+        return not_modified
+
+    columns = [TestResult.id, TestResult.test_type, TestResult.mbti_type, TestResult.created_at]
+    if include_analysis:
+        columns += [TestResult.legacy_analysis, AnalysisBlob.body, AnalysisBlob.encoding]
+
+    query = select(*columns).where(TestResult.user_id == current_user.id)
+    if include_analysis:
+        query = query.outerjoin(AnalysisBlob, AnalysisBlob.hash == TestResult.analysis_hash)
+    if cursor:
+        created_at, result_id = _decode_cursor(cursor)
+        query = query.where(or_(
+            TestResult.created_at < created_at,
+            and_(TestResult.created_at == created_at, TestResult.id < result_id)
+        ))
+
+    # یک ردیف اضافه برای تشخیص وجود صفحه بعد
+    query = query.order_by(TestResult.created_at.desc(), TestResult.id.desc()).limit(limit + 1)
+    rows = (await db.execute(query)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    items = []
+    for row in rows:
+        item = {"id": row.id, "test_type": row.test_type, "mbti_type": row.mbti_type, "created_at": row.created_at}
+        if include_analysis:
+            item["analysis"] = decode_analysis(row.body, row.encoding) if row.body is not None else row.legacy_analysis
+        items.append(item)
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/dashboard/results/{result_id}", response_model=TestResultResponse)
+async def get_test_result(result_id: str, current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    """دریافت یک نتیجه تست همراه با متن کامل تحلیل"""
+    result = (await db.execute(select(TestResult).where(
+        TestResult.id == result_id,
+        TestResult.user_id == current_user.id
+    ))).scalar_one_or_none()
+    if result is None:
+        raise HTTPException(status_code=404, detail="نتیجه تست یافت نشد")
+    return result
+
+def _sse_event(data: dict, event: str = None) -> str:
+    """قالب‌بندی یک رویداد Server-Sent Events"""
+    payload = f"data: {orjson.dumps(data).decode()}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+@app.post("/analyze/stream")
+async def analyze_mbti_stream(mbti_data: dict, current_user: CurrentUser = Depends(get_current_user)):
+    """تحلیل تیپ شخصیتی MBTI به صورت جریانی (SSE)"""
+    mbti_type = mbti_data.get("mbti_type")
+    if not mbti_type:
+        raise HTTPException(status_code=400, detail="تیپ شخصیتی الزامی است")
+
+    user_id = current_user.id
+    key = cache_key("MBTI", mbti_type, MBTI_PROMPT_VERSION)
+    logger.info(f"درخواست تحلیل جریانی برای تیپ شخصیتی: {mbti_type}")
+
+    # مجوز فراخوانی مدل پیش از شروع پاسخ گرفته می‌شود تا در اشباع 429 برگردد
+    cached = await get_cached_variant(key)
+    if cached is None and llm_circuit.is_open():
+        # مدار باز است؛ بدون تحلیل جایگزین 503 برمی‌گردد
+        cached = await get_fallback_analysis("MBTI", mbti_type, MBTI_PROMPT_VERSION)
+        if cached is None:
+            raise LLMUnavailableError("LLM circuit is open")
+    ticket = None
+    if cached is None:
+        ticket = await llm_admission.acquire(user_id, is_priority_user(current_user.plan))
+
+    async def event_stream():
+        # بخش‌ها فقط برای ذخیره نهایی نگه داشته می‌شوند و بلافاصله ارسال می‌شوند
+        parts = []
+        try:
+            if cached is not None:
+                parts.append(cached)
+                yield _sse_event({"delta": cached})
+            else:
+                try:
+                    # درخواست‌های هم‌زمان هم‌تیپ یک فراخوانی بالادستی مشترک دارند
+                    async for delta in stream_or_generate(
+                        "MBTI", mbti_type, MBTI_PROMPT_VERSION, lambda: stream_mbti_analysis(mbti_type)
+                    ):
+                        parts.append(delta)
+                        yield _sse_event({"delta": delta})
+                except LLMUnavailableError:
+                    # قبل از اولین بخش هنوز می‌توان تحلیل جایگزین فرستاد
+                    fallback = None
+                    if not parts:
+                        fallback = await get_fallback_analysis("MBTI", mbti_type, MBTI_PROMPT_VERSION)
+                    if fallback is None:
+                        raise
+                    parts.append(fallback)
+                    yield _sse_event({"delta": fallback})
+                ticket.release()
+
+            analysis = "".join(parts)
+            logger.info(f"تحلیل جریانی کامل شد. طول متن: {len(analysis)} کاراکتر")
+
+            # ذخیره نتیجه در دیتابیس پس از پایان جریان
+            async with AsyncSessionLocal() as db:
+                test_result = TestResult(
+                    user_id=user_id,
+                    test_type="MBTI",
+                    mbti_type=mbti_type,
+                    analysis_hash=await store_analysis(db, analysis)
+                )
+                db.add(test_result)
+                await db.commit()
+                result_id = test_result.id
+            await bump_results_version(user_id)
+
+            yield _sse_event({"id": result_id}, event="done")
+        except Exception as e:
+            logger.exception(f"خطا در تحلیل جریانی شخصیت: {str(e)}")
+            yield _sse_event(
+                {"detail": "متأسفانه در تحلیل شخصیت شما مشکلی پیش آمده است. لطفاً دوباره تلاش کنید."},
+                event="error"
+            )
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # اگر جریان هرگز شروع نشود، مجوز اینجا آزاد می‌شود
+        background=BackgroundTask(ticket.release) if ticket is not None else None
+    )
+
+# API‌های سلامت
+@app.get("/health/live")
+async def liveness():
+    """زنده بودن فرآیند؛ به هیچ وابستگی خارجی دست نمی‌زند"""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def readiness():
+    """آمادگی دریافت ترافیک: شمای دیتابیس، Redis و کلید مدل زبانی"""
+    checks = {}
+
+    schema_task = app.state.schema_task
+    if not schema_task.done():
+        checks["database"] = "pending"
+    elif schema_task.cancelled() or schema_task.exception() is not None:
+        checks["database"] = "error"
+    else:
+        checks["database"] = "ok"
+
+    try:
+        await asyncio.wait_for(get_async_redis_client().ping(), READINESS_CHECK_TIMEOUT)
+        checks["redis"] = "ok"
+    except Exception as e:
+        logger.warning(f"Redis آماده نیست: {e}")
+        checks["redis"] = "error"
+
+    checks["llm"] = "ok" if llm_configured() else "missing_api_key"
+
+    ready = all(value == "ok" for value in checks.values())
+    return ORJSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if ready else "not_ready", "checks": checks}
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """معیارهای Prometheus"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/health/startup")
+async def startup_report():
+    """گزارش زمان‌بندی راه‌اندازی این worker"""
+    return {"pid": os.getpid(), "timings": startup_timings}
@@ -0,0 +1,135 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, REGISTRY, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from sqlalchemy import event
+
+# بازه‌های هیستوگرام از چند میلی‌ثانیه (Redis/SQL) تا ده‌ها ثانیه (مدل زبانی)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", multiprocess_mode="livesum",
+)
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "Upstream LLM call latency",
+    ["operation", "outcome"], buckets=LATENCY_BUCKETS,
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "Time until the first streamed LLM token",
+    buckets=LATENCY_BUCKETS,
+)
+LLM_REQUESTS_IN_FLIGHT = Gauge(
+    "llm_requests_in_flight", "Upstream LLM calls currently running", multiprocess_mode="livesum",
+)
+LLM_ADMISSION_QUEUED = Gauge(
+    "llm_admission_queued", "LLM calls waiting for an admission slot", multiprocess_mode="livesum",
+)
+LLM_ADMISSION_REJECTED = Counter(
+    "llm_admission_rejected_total", "LLM calls shed by admission control", ["reason"],
+)
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total", "Log records discarded because the logging queue was full",
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "SQL statement execution latency",
+    ["statement"], buckets=LATENCY_BUCKETS,
+)
+REDIS_COMMAND_DURATION = Histogram(
+    "redis_command_duration_seconds", "Redis round-trip latency by operation",
+    ["operation", "outcome"], buckets=LATENCY_BUCKETS,
+)
+
+
+@contextmanager
+def track_llm(operation: str):
+    """اندازه‌گیری یک فراخوانی مدل زبانی و تعداد فراخوانی‌های هم‌زمان"""
+    LLM_REQUESTS_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        LLM_REQUESTS_IN_FLIGHT.dec()
+        LLM_REQUEST_DURATION.labels(operation, outcome).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def track_redis(operation: str):
+    """اندازه‌گیری یک رفت‌وبرگشت Redis"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        REDIS_COMMAND_DURATION.labels(operation, outcome).observe(time.perf_counter() - started)
+
+
+def instrument_engine(engine):
+    """ثبت زمان اجرای هر دستور SQL از طریق رویدادهای SQLAlchemy"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement else "UNKNOWN"
+        DB_QUERY_DURATION.labels(verb).observe(time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+class MetricsMiddleware:
+    """هیستوگرام تأخیر درخواست‌ها بر اساس الگوی مسیر (نه مسیر خام) و وضعیت پاسخ"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status_code)
+            ).observe(time.perf_counter() - started)
+
+
+def render_metrics():
+    """خروجی متنی Prometheus؛ در حالت چند worker از PROMETHEUS_MULTIPROC_DIR تجمیع می‌شود"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
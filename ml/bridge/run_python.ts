@@ -1,4 +1,5 @@
 import { spawn } from "child_process";
+import http from "http";
 
 export async function runPython(script: string, args: string[] = []): Promise<string> {
   return new Promise((resolve, reject) => {
@@ -16,15 +17,50 @@ export async function runPython(script: string, args: string[] = []): Promise<st
   });
 }
 
+// سرور پیش‌بینی مقیم (python ml/core/predict.py --serve)؛ سوکت یونیکس یا آدرس HTTP
+const PREDICT_SERVER_SOCKET = process.env.PREDICT_SERVER_SOCKET;
+const PREDICT_SERVER_URL = process.env.PREDICT_SERVER_URL;
+const PREDICT_SERVER_TIMEOUT_MS = Number(process.env.PREDICT_SERVER_TIMEOUT_MS || 2000);
+
+const agent = new http.Agent({ keepAlive: true });
+
+// ارسال درخواست به سرور پیش‌بینی؛ اگر سرور تنظیم نشده یا در دسترس نباشد null برمی‌گرداند
+export async function callPredictServer(payload: unknown): Promise<string | null> {
+  if (!PREDICT_SERVER_SOCKET && !PREDICT_SERVER_URL) return null;
+
+  const body = JSON.stringify(payload);
+  const target = PREDICT_SERVER_SOCKET
+    ? { socketPath: PREDICT_SERVER_SOCKET, path: "/predict" }
+    : (() => {
+        const url = new URL("/predict", PREDICT_SERVER_URL);
+        return { hostname: url.hostname, port: url.port, path: url.pathname };
+      })();
+
+  return new Promise((resolve) => {
+    const request = http.request(
+      {
+        ...target,
+        method: "POST",
+        agent,
+        timeout: PREDICT_SERVER_TIMEOUT_MS,
+        headers: { "Content-Type": "application/json", "Content-Length": Buffer.byteLength(body) },
+      },
+      (response) => {
+        let output = "";
+        response.setEncoding("utf8");
+        response.on("data", (chunk) => (output += chunk));
+        response.on("end", () => resolve(output));
+      }
+    );
+    request.on("timeout", () => request.destroy());
+    request.on("error", () => resolve(null));
+    request.end(body);
+  });
+}
 
-
-
-
-
-
-
-
-
-
-
-
+// پیش‌بینی از سرور مقیم و در صورت نبود آن با اجرای مستقیم predict.py
+export async function runPredict(userData: unknown): Promise<string> {
+  const output = await callPredictServer(userData);
+  if (output !== null) return output;
+  return runPython("ml/core/predict.py", [JSON.stringify(userData)]);
+}
@@ -4,25 +4,44 @@
 این اسکریپت مدل را به صورت خودکار بهینه‌سازی می‌کند
 """
 
+import argparse
 import json
+import math
 import os
 import sys
+import time
 import joblib
 import pandas as pd
 import numpy as np
 from datetime import datetime
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split, GridSearchCV, RandomizedSearchCV
+from sklearn.model_selection import (
+    train_test_split, cross_val_score, GridSearchCV, RandomizedSearchCV, ParameterGrid, ParameterSampler
+)
 from sklearn.metrics import accuracy_score, classification_report
 from sklearn.preprocessing import LabelEncoder, MinMaxScaler
 
 # اضافه کردن مسیر utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from core.predict import export_model_artifacts
 
 LOG_PATH = "ml/data/optimization_log.json"
 MODEL_PATH = "ml/core/model.pkl"
 BACKUP_PATH = "ml/core/model_backup_optimized.pkl"
 
+# جستجوی بودجه‌دار (successive halving روی حجم نمونه و تعداد درخت‌ها)
+SEARCH_TIME_BUDGET = 300.0  # ثانیه زمان واقعی
+SEARCH_CPU_BUDGET = None  # ثانیه CPU همه threadهای فرایند؛ None یعنی بدون محدودیت
+HALVING_FACTOR = 3
+MAX_RUNGS = 5
+MIN_TREES = 10
+# حداقل نمونه هر کلاس در هر fold در کوچک‌ترین پله
+MIN_SAMPLES_PER_CLASS = 4
+CV_FOLDS = 3
+# توقف وقتی چند bracket پیاپی بهترین امتیاز را بیش از این مقدار بهتر نکنند
+PLATEAU_TOLERANCE = 0.002
+PLATEAU_PATIENCE = 2
+
 def load_data_and_preprocess():
     """بارگذاری و پیش‌پردازش داده‌ها"""
     try:
@@ -133,6 +152,161 @@ def optimize_with_random_search(X, y):
     
     return best_model, random_search.best_params_, accuracy, random_search.best_score_
 
+class SearchBudget:
+    """بودجه زمان واقعی و زمان CPU جستجو"""
+
+    def __init__(self, time_budget=SEARCH_TIME_BUDGET, cpu_budget=SEARCH_CPU_BUDGET):
+        self.time_budget = time_budget
+        self.cpu_budget = cpu_budget
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+
+    def wall_seconds(self):
+        return time.perf_counter() - self.started
+
+    def cpu_seconds(self):
+        return time.process_time() - self.cpu_started
+
+    def exhausted(self):
+        """دلیل پایان بودجه یا None"""
+        if self.time_budget is not None and self.wall_seconds() >= self.time_budget:
+            return "time_budget"
+        if self.cpu_budget is not None and self.cpu_seconds() >= self.cpu_budget:
+            return "cpu_budget"
+        return None
+
+def halving_fractions(n_samples, n_classes):
+    """نسبت حجم نمونه در هر پله؛ پله آخر همه داده‌هاست"""
+    min_fraction = min(1.0, n_classes * CV_FOLDS * MIN_SAMPLES_PER_CLASS / n_samples)
+    rungs = 1 + int(math.floor(math.log(1 / min_fraction, HALVING_FACTOR) + 1e-9))
+    rungs = max(1, min(MAX_RUNGS, rungs))
+    return [HALVING_FACTOR ** -(rungs - 1 - i) for i in range(rungs)]
+
+def evaluate_candidate(params, X, y, fraction):
+    """امتیاز cross-validation یک پیکربندی با تعداد درخت متناسب با حجم نمونه"""
+    n_estimators = max(MIN_TREES, int(round(params["n_estimators"] * fraction)))
+    model = RandomForestClassifier(random_state=42, n_jobs=-1, **{**params, "n_estimators": n_estimators})
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    # foldها در همین فرایند اجرا می‌شوند تا زمان CPU درخت‌ها در بودجه شمرده شود
+    score = cross_val_score(model, X, y, cv=CV_FOLDS, scoring="accuracy").mean()
+    return {
+        "params": params,
+        "fraction": round(fraction, 4),
+        "samples": len(X),
+        "n_estimators": n_estimators,
+        "cv_score": float(score),
+        "cpu_seconds": time.process_time() - cpu_started,
+        "wall_seconds": time.perf_counter() - wall_started,
+    }
+
+def run_halving_bracket(candidates, X, y, fractions, budget, trials, seed):
+    """اجرای یک bracket: ارزیابی همه نامزدها روی نمونه کوچک و ارتقای بهترین یک‌سوم به پله بعد"""
+    for rung, fraction in enumerate(fractions):
+        if fraction < 1:
+            X_rung, _, y_rung, _ = train_test_split(
+                X, y, train_size=fraction, random_state=seed + rung, stratify=y
+            )
+        else:
+            X_rung, y_rung = X, y
+
+        results = []
+        for params in candidates:
+            reason = budget.exhausted()
+            if reason:
+                trials.extend(results)
+                return reason
+            result = evaluate_candidate(params, X_rung, y_rung, fraction)
+            result["rung"] = rung
+            results.append(result)
+        trials.extend(results)
+
+        # تعداد ارتقایافته‌ها در هر پله بر HALVING_FACTOR تقسیم می‌شود
+        results.sort(key=lambda r: (-r["cv_score"], r["cpu_seconds"]))
+        keep = max(1, len(results) // HALVING_FACTOR)
+        candidates = [r["params"] for r in results[:keep]]
+    return None
+
+def accuracy_cost_frontier(trials):
+    """پیکربندی‌هایی که هیچ پیکربندی ارزان‌تری امتیاز بهتر یا برابر با آن‌ها ندارد"""
+    frontier, best_score = [], -1.0
+    for trial in sorted(trials, key=lambda t: (t["cpu_seconds"], -t["cv_score"])):
+        if trial["cv_score"] > best_score:
+            best_score = trial["cv_score"]
+            frontier.append({
+                "cv_score": round(trial["cv_score"], 4),
+                "cpu_seconds": round(trial["cpu_seconds"], 3),
+                "n_estimators": trial["n_estimators"],
+                "params": trial["params"],
+            })
+    return frontier
+
+def optimize_with_budgeted_search(X, y, time_budget=SEARCH_TIME_BUDGET, cpu_budget=SEARCH_CPU_BUDGET):
+    """بهینه‌سازی با successive halving در چند bracket تا پایان بودجه یا ثابت ماندن بهترین امتیاز"""
+    print("🔍 شروع بهینه‌سازی بودجه‌دار (Successive Halving)...")
+
+    # تقسیم داده‌ها
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.25, random_state=42, stratify=y
+    )
+
+    param_grid = create_parameter_grid()
+    space_size = len(ParameterGrid(param_grid))
+    # نمونه‌برداری بدون جایگزینی از فضای پارامترها؛ هر پیکربندی حداکثر یک بار آزموده می‌شود
+    sampler = iter(ParameterSampler(param_grid, n_iter=space_size, random_state=42))
+    fractions = halving_fractions(len(X_train), y_train.nunique())
+    bracket_size = HALVING_FACTOR ** (len(fractions) - 1)
+
+    budget = SearchBudget(time_budget, cpu_budget)
+    trials, brackets, stale = [], 0, 0
+    best_score, stop_reason = -1.0, None
+    while stop_reason is None:
+        candidates = [params for _, params in zip(range(bracket_size), sampler)]
+        if not candidates:
+            stop_reason = "search_space_exhausted"
+            break
+        stop_reason = run_halving_bracket(
+            candidates, X_train, y_train, fractions, budget, trials, seed=brackets * 100
+        )
+        brackets += 1
+
+        full = [t for t in trials if t["fraction"] == 1]
+        current_best = max((t["cv_score"] for t in full), default=-1.0)
+        print(f"📊 bracket {brackets}: بهترین امتیاز تاکنون {current_best:.4f} پس از {len(trials)} ارزیابی")
+        if current_best - best_score < PLATEAU_TOLERANCE:
+            stale += 1
+            if stale >= PLATEAU_PATIENCE and stop_reason is None:
+                stop_reason = "plateau"
+        else:
+            stale = 0
+        best_score = max(best_score, current_best)
+
+    if not trials:
+        raise ValueError("بودجه جستجو برای ارزیابی حتی یک پیکربندی کافی نبود")
+
+    # بهترین پیکربندی روی همه داده‌ها؛ اگر بودجه پیش از آن تمام شد بهترین پله بالاتر
+    top_rung = max(t["rung"] for t in trials)
+    best = max(
+        (t for t in trials if t["rung"] == top_rung),
+        key=lambda t: (t["cv_score"], -t["cpu_seconds"])
+    )
+    best_params = best["params"]
+    best_model = RandomForestClassifier(random_state=42, n_jobs=-1, **best_params)
+    best_model.fit(X_train, y_train)
+    accuracy = accuracy_score(y_test, best_model.predict(X_test))
+
+    report = {
+        "evaluations": len(trials),
+        "brackets": brackets,
+        "rung_fractions": [round(f, 4) for f in fractions],
+        "stop_reason": stop_reason,
+        "wall_seconds": round(budget.wall_seconds(), 2),
+        "cpu_seconds": round(budget.cpu_seconds(), 2),
+        "time_budget": time_budget,
+        "cpu_budget": cpu_budget,
+        "frontier": accuracy_cost_frontier([t for t in trials if t["fraction"] == 1]),
+    }
+    return best_model, best_params, accuracy, best["cv_score"], report
+
 def backup_existing_model():
     """پشتیبان‌گیری از مدل موجود"""
     if os.path.exists(MODEL_PATH):
@@ -141,7 +315,7 @@ def backup_existing_model():
         return True
     return False
 
-def save_optimization_log(best_params, accuracy, cv_score, method):
+def save_optimization_log(best_params, accuracy, cv_score, method, search_report=None):
     """ذخیره لاگ بهینه‌سازی"""
     log_entry = {
         "timestamp": datetime.now().isoformat(),
@@ -151,6 +325,8 @@ def save_optimization_log(best_params, accuracy, cv_score, method):
         "cv_score": round(cv_score, 4),
         "improvement": "N/A"  # در اولین اجرا
     }
+    if search_report is not None:
+        log_entry["search"] = search_report
     
     # خواندن تاریخچه موجود
     if os.path.exists(LOG_PATH):
@@ -177,8 +353,8 @@ def save_optimization_log(best_params, accuracy, cv_score, method):
     with open(LOG_PATH, 'w', encoding='utf-8') as f:
         json.dump(history, f, ensure_ascii=False, indent=2)
 
-def optimize_model():
-    """تابع اصلی بهینه‌سازی مدل"""
+def optimize_model(method="budgeted", time_budget=SEARCH_TIME_BUDGET, cpu_budget=SEARCH_CPU_BUDGET):
+    """تابع اصلی بهینه‌سازی مدل؛ method یکی از budgeted، grid، random یا auto (انتخاب بر اساس حجم داده)"""
     try:
         print("⚙️ شروع بهینه‌سازی خودکار مدل Testology")
         print("=" * 50)
@@ -193,8 +369,15 @@ def optimize_model():
         # پشتیبان‌گیری از مدل موجود
         backup_created = backup_existing_model()
         
+        search_report = None
+        if method == "budgeted":
+            print(f"📈 جستجوی بودجه‌دار - حداکثر {time_budget} ثانیه")
+            best_model, best_params, accuracy, cv_score, search_report = optimize_with_budgeted_search(
+                X, y, time_budget, cpu_budget
+            )
+            method = "SuccessiveHalving"
         # انتخاب روش بهینه‌سازی بر اساس حجم داده
-        if len(X) < 1000:
+        elif method == "grid" or (method == "auto" and len(X) < 1000):
             print("📈 حجم داده کم - استفاده از GridSearchCV")
             best_model, best_params, accuracy, cv_score = optimize_with_grid_search(X, y)
             method = "GridSearchCV"
@@ -208,9 +391,11 @@ def optimize_model():
         joblib.dump(best_model, MODEL_PATH)
         joblib.dump(le, "ml/core/label_encoder.pkl")
         joblib.dump(scaler, "ml/core/scaler.pkl")
+        # نسخه کامپایل‌شده مدل و جدول پیش‌بینی برای پیش‌بینی کم‌تأخیر
+        export_model_artifacts()
         
         # ذخیره لاگ
-        save_optimization_log(best_params, accuracy, cv_score, method)
+        save_optimization_log(best_params, accuracy, cv_score, method, search_report)
         
         # گزارش تفصیلی
         report = classification_report(y, best_model.predict(X), output_dict=True)
@@ -223,6 +408,7 @@ def optimize_model():
             "accuracy": round(accuracy, 4),
             "cv_score": round(cv_score, 4),
             "backup_created": backup_created,
+            "search_report": search_report,
             "timestamp": datetime.now().isoformat(),
             "model_info": {
                 "n_estimators": best_params.get('n_estimators'),
@@ -254,10 +440,16 @@ def optimize_model():
 
 def main():
     """تابع اصلی"""
+    parser = argparse.ArgumentParser(description="Random forest hyperparameter optimization")
+    parser.add_argument("--method", choices=("budgeted", "grid", "random", "auto"), default="budgeted")
+    parser.add_argument("--time-budget", type=float, default=SEARCH_TIME_BUDGET, help="wall-clock seconds")
+    parser.add_argument("--cpu-budget", type=float, default=SEARCH_CPU_BUDGET, help="CPU seconds")
+    args = parser.parse_args()
+
     print("🧠 سیستم بهینه‌سازی خودکار Testology")
     print("=" * 40)
     
-    result = optimize_model()
+    result = optimize_model(args.method, args.time_budget, args.cpu_budget)
     
     # خروجی JSON برای API
     print(json.dumps(result, ensure_ascii=False))
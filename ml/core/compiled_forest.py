@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+جنگل تصادفی کامپایل‌شده Testology
+درخت‌های مدل آموزش‌دیده در چند آرایه پیوسته NumPy ذخیره می‌شوند و پیمایش همه درخت‌ها
+برای همه ردیف‌ها هم‌زمان و بدون sklearn انجام می‌شود. خروجی همان predict_proba مدل است.
+
+نمونه اجرا:
+    python ml/core/compiled_forest.py          # ساخت ml/core/model.npz از فایل‌های pkl فعلی
+"""
+
+import os
+import sys
+
+import numpy as np
+
+COMPILED_MODEL_PATH = "ml/core/model.npz"
+# تعداد ردیف‌هایی که هم‌زمان پیمایش می‌شوند؛ حافظه موقت حدود rows × trees × classes عدد
+EVAL_CHUNK_SIZE = 1024
+
+
+class CompiledForest:
+    """ارزیابی جنگل از روی آرایه‌ها؛ رابط آن (classes_ و predict_proba) هم‌شکل مدل sklearn است"""
+
+    def __init__(self, feature, threshold, left, right, value, roots, depth, classes):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        # فرزندان هر گره کنار هم: children[2 * node + (x <= threshold)]
+        self.children = np.stack([right, left], axis=1).ravel()
+        self.value = value
+        self.roots = roots
+        self.depth = int(depth)
+        self.classes_ = classes
+        self.n_features_in_ = int(feature.max()) + 1 if len(feature) else 0
+        # برای سازگاری با کدی که روی مدل sklearn تعداد پردازنده را تنظیم می‌کند
+        self.n_jobs = None
+
+    def _leaves(self, X):
+        """شماره برگ هر درخت برای هر ردیف؛ آرایه (ردیف‌ها، درخت‌ها)"""
+        n_rows = X.shape[0]
+        flat = X.ravel()
+        offsets = (np.arange(n_rows, dtype=np.int32) * X.shape[1])[:, None]
+        nodes = np.broadcast_to(self.roots, (n_rows, len(self.roots)))
+        # برگ‌ها به خودشان اشاره می‌کنند، پس پس از depth گام همه مسیرها به برگ رسیده‌اند
+        for _ in range(self.depth):
+            go_left = flat[offsets + self.feature[nodes]] <= self.threshold[nodes]
+            nodes = self.children[(nodes << 1) + go_left]
+        return nodes
+
+    def predict_proba(self, X):
+        # sklearn ویژگی‌ها را پیش از مقایسه با آستانه‌ها به float32 تبدیل می‌کند
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        proba = np.empty((X.shape[0], len(self.classes_)))
+        n_trees = len(self.roots)
+        for start in range(0, X.shape[0], EVAL_CHUNK_SIZE):
+            chunk = X[start:start + EVAL_CHUNK_SIZE]
+            # جمع روی محور درخت‌ها به ترتیب درخت‌ها انجام می‌شود، همانند جمع تدریجی sklearn
+            proba[start:start + len(chunk)] = self.value[self._leaves(chunk)].sum(axis=1) / n_trees
+        return proba
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+class CompiledMinMaxScaler:
+    """معادل transform در MinMaxScaler"""
+
+    def __init__(self, scale, min_, clip=False, feature_range=(0, 1)):
+        self.scale_ = scale
+        self.min_ = min_
+        self.clip = bool(clip)
+        self.feature_range = tuple(feature_range)
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float64) * self.scale_ + self.min_
+        if self.clip:
+            np.clip(X, self.feature_range[0], self.feature_range[1], out=X)
+        return X
+
+
+class CompiledLabelEncoder:
+    """کلاس‌های LabelEncoder؛ کدگذاری در predict.encode_genders انجام می‌شود"""
+
+    def __init__(self, classes):
+        self.classes_ = classes
+
+
+def flatten_forest(model):
+    """تبدیل درخت‌های یک RandomForestClassifier به آرایه‌های پیوسته با اندیس‌های سراسری"""
+    if getattr(model, "n_outputs_", 1) != 1:
+        raise ValueError("only single-output forests can be compiled")
+
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset, depth = 0, 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        leaf = tree.children_left == -1
+        own = np.arange(offset, offset + n_nodes)
+        features.append(np.where(leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(np.where(leaf, 0.0, tree.threshold))
+        lefts.append(np.where(leaf, own, tree.children_left + offset).astype(np.int32))
+        rights.append(np.where(leaf, own, tree.children_right + offset).astype(np.int32))
+
+        # مقدار هر گره وزن نمونه‌های هر کلاس است؛ مانند predict_proba درخت نرمال می‌شود
+        value = tree.value[:, 0, :len(model.classes_)].astype(np.float64)
+        normalizer = value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        values.append(value / normalizer)
+
+        roots.append(offset)
+        offset += n_nodes
+        depth = max(depth, tree.max_depth)
+
+    return {
+        "feature": np.concatenate(features),
+        "threshold": np.concatenate(thresholds),
+        "left": np.concatenate(lefts),
+        "right": np.concatenate(rights),
+        "value": np.concatenate(values),
+        "roots": np.asarray(roots, dtype=np.int32),
+        "depth": np.asarray(depth),
+        "classes": np.asarray(model.classes_).astype(str),
+    }
+
+
+def export_compiled(model, le, scaler, fingerprint, path=COMPILED_MODEL_PATH, source_stat=None):
+    """ذخیره مدل، LabelEncoder و MinMaxScaler در یک فایل npz به همراه اثر انگشت و (اندازه، زمان تغییر) model.pkl"""
+    arrays = flatten_forest(model)
+    arrays.update({
+        "gender_classes": np.asarray(le.classes_).astype(str),
+        "scaler_scale": np.asarray(scaler.scale_, dtype=np.float64),
+        "scaler_min": np.asarray(scaler.min_, dtype=np.float64),
+        "scaler_clip": np.asarray(bool(getattr(scaler, "clip", False))),
+        "scaler_range": np.asarray(scaler.feature_range, dtype=np.float64),
+        "fingerprint": np.asarray(fingerprint),
+    })
+    if source_stat is not None:
+        arrays["source_stat"] = np.asarray(source_stat, dtype=np.int64)
+    # نوشتن در فایل موقت و جایگزینی اتمی تا سرور پیش‌بینی فایل نیمه‌کاره نخواند
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_compiled(path=COMPILED_MODEL_PATH):
+    """بارگذاری فایل npz؛ خروجی ((مدل، LabelEncoder، scaler)، اثر انگشت model.pkl، (اندازه، زمان تغییر) یا None)"""
+    with np.load(path, allow_pickle=False) as data:
+        forest = CompiledForest(
+            data["feature"], data["threshold"], data["left"], data["right"],
+            data["value"], data["roots"], data["depth"], data["classes"].astype(object)
+        )
+        le = CompiledLabelEncoder(data["gender_classes"])
+        scaler = CompiledMinMaxScaler(
+            data["scaler_scale"], data["scaler_min"], data["scaler_clip"], data["scaler_range"]
+        )
+        source_stat = tuple(int(v) for v in data["source_stat"]) if "source_stat" in data.files else None
+        return (forest, le, scaler), str(data["fingerprint"]), source_stat
+
+
+def main():
+    """ساخت مدل کامپایل‌شده از فایل‌های pkl فعلی"""
+    import json
+    sys.path.append(os.path.dirname(__file__))
+    from predict import export_compiled_model
+
+    path = export_compiled_model()
+    print(json.dumps({"status": "success", "path": path}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,189 @@
-import joblib
+import hashlib
 import json
+import os
 import sys
+import warnings
 import numpy as np
 
-def load_model():
+sys.path.append(os.path.dirname(__file__))
+
+from compiled_forest import COMPILED_MODEL_PATH, CompiledLabelEncoder, export_compiled, load_compiled
+from prediction_table import PREDICTION_TABLE_PATH, grid_axes, load_table, save_table
+
+MODEL_PATH = "ml/core/model.pkl"
+LABEL_ENCODER_PATH = "ml/core/label_encoder.pkl"
+SCALER_PATH = "ml/core/scaler.pkl"
+
+# مدل و scaler روی DataFrame آموزش دیده‌اند ولی پیش‌بینی با آرایه numpy انجام می‌شود
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+_fingerprints = {}
+
+
+class ModelNotTrainedError(FileNotFoundError):
+    """فایل‌های مدل هنوز ساخته نشده‌اند"""
+
+
+def model_fingerprint(path=MODEL_PATH):
+    """اثر انگشت محتوای model.pkl برای تشخیص کهنه بودن خروجی‌های مشتق‌شده از مدل"""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _fingerprints:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        _fingerprints[key] = digest.hexdigest()
+    return _fingerprints[key]
+
+def model_source_stat(path=MODEL_PATH):
+    """(اندازه، زمان تغییر) model.pkl که کنار اثر انگشت در خروجی‌های مشتق ذخیره می‌شود"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def built_from_current_model(fingerprint, source_stat=None, path=MODEL_PATH):
+    """آیا خروجی مشتق از model.pkl فعلی ساخته شده است؛ فقط اگر اندازه یا زمان تغییر فایل فرق کند هش محاسبه می‌شود"""
+    if not os.path.exists(path):
+        return True
+    if source_stat is not None and tuple(source_stat) == model_source_stat(path):
+        return True
+    return fingerprint == model_fingerprint(path)
+
+def load_model(prefer_compiled=True):
     """بارگذاری مدل و preprocessors"""
+    if prefer_compiled and os.path.exists(COMPILED_MODEL_PATH):
+        # مدل کامپایل‌شده بدون sklearn بارگذاری می‌شود، به شرطی که از model.pkl فعلی ساخته شده باشد
+        try:
+            artifacts, fingerprint, source_stat = load_compiled(COMPILED_MODEL_PATH)
+            if built_from_current_model(fingerprint, source_stat):
+                return artifacts
+            print("⚠️ model.npz قدیمی است؛ از model.pkl استفاده می‌شود", file=sys.stderr)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ بارگذاری model.npz ناموفق بود: {e}", file=sys.stderr)
+
+    # joblib (و sklearn) فقط در مسیر pickle بارگذاری می‌شود
+    import joblib
     try:
-        model = joblib.load("ml/core/model.pkl")
-        le = joblib.load("ml/core/label_encoder.pkl")
-        scaler = joblib.load("ml/core/scaler.pkl")
+        model = joblib.load(MODEL_PATH)
+        le = joblib.load(LABEL_ENCODER_PATH)
+        scaler = joblib.load(SCALER_PATH)
         return model, le, scaler
-    except FileNotFoundError:
-        print(json.dumps({
-            "status": "error",
-            "message": "مدل هنوز آموزش ندیده. ابتدا train_model.py را اجرا کنید."
-        }))
-        sys.exit(1)
+    except FileNotFoundError as e:
+        # فراخواننده تصمیم می‌گیرد؛ CLI پیام خطا چاپ و خارج می‌شود و سرور پیش‌بینی مدل قبلی را نگه می‌دارد
+        raise ModelNotTrainedError("مدل هنوز آموزش ندیده. ابتدا train_model.py را اجرا کنید.") from e
 
-def predict_user_category(user_data):
-    """پیش‌بینی دسته‌بندی کاربر"""
-    model, le, scaler = load_model()
-    
-    # آماده‌سازی داده‌های کاربر
-    score = float(user_data.get("score", 50))
-    gender = user_data.get("gender", "male")
-    age = int(user_data.get("age", 25))
-    
-    # کدگذاری جنسیت
+def load_prediction_table():
+    """جدول پیش‌بینی در صورت وجود و ساخته شدن از model.pkl فعلی؛ در غیر این صورت None"""
+    if not os.path.exists(PREDICTION_TABLE_PATH):
+        return None
     try:
-        gender_encoded = le.transform([gender])[0]
-    except ValueError:
-        # اگر جنسیت جدید بود، از کد پیش‌فرض استفاده کن
-        gender_encoded = 0
-    
+        table = load_table(PREDICTION_TABLE_PATH)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️ بارگذاری prediction_table.npz ناموفق بود: {e}", file=sys.stderr)
+        return None
+    if not built_from_current_model(table.fingerprint, table.source_stat):
+        print("⚠️ prediction_table.npz قدیمی است؛ از مدل استفاده می‌شود", file=sys.stderr)
+        return None
+    return table
+
+def export_compiled_model():
+    """ساخت model.npz از فایل‌های pkl فعلی"""
+    import joblib
+    # مشخصات فایل پیش از خواندن آن گرفته می‌شود تا بازنویسی هم‌زمان model.pkl فعلی جلوه نکند
+    source_stat, fingerprint = model_source_stat(), model_fingerprint()
+    model = joblib.load(MODEL_PATH)
+    le = joblib.load(LABEL_ENCODER_PATH)
+    scaler = joblib.load(SCALER_PATH)
+    return export_compiled(model, le, scaler, fingerprint, COMPILED_MODEL_PATH, source_stat)
+
+def export_prediction_table():
+    """پیش‌بینی همه نقاط جدول (نمره × جنسیت × سن) با مدل فعلی و ذخیره آن"""
+    source_stat, fingerprint = model_source_stat(), model_fingerprint()
+    model, le, scaler = load_model(prefer_compiled=False)
+    scores, ages = grid_axes()
+    genders = np.asarray(le.classes_)
+    grid_scores, grid_genders, grid_ages = np.meshgrid(scores, np.arange(len(genders)), ages, indexing="ij")
+    X = build_feature_matrix(grid_scores.ravel(), genders[grid_genders.ravel()], grid_ages.ravel(), le, scaler)
+    _, probabilities = predict_matrix(X, model)
+    probabilities = probabilities.reshape(grid_scores.shape + (len(model.classes_),))
+    return save_table(probabilities, model.classes_, genders, fingerprint, PREDICTION_TABLE_PATH, source_stat)
+
+def export_model_artifacts():
+    """ساخت خروجی‌های مشتق از مدل (model.npz و جدول پیش‌بینی)؛ پس از هر ذخیره model.pkl فراخوانی می‌شود"""
+    return export_compiled_model(), export_prediction_table()
+
+def encode_genders(genders, le):
+    """کدگذاری آرایه‌ای جنسیت؛ مقادیر ناشناخته کد پیش‌فرض 0 می‌گیرند"""
+    genders = np.asarray(genders, dtype=str)
+    classes = np.asarray(le.classes_, dtype=str)
+    # classes_ در LabelEncoder مرتب است
+    positions = np.searchsorted(classes, genders)
+    positions = np.minimum(positions, len(classes) - 1)
+    return np.where(classes[positions] == genders, positions, 0)
+
+def build_feature_matrix(scores, genders, ages, le, scaler):
+    """ساخت ماتریس ویژگی (score_scaled, gender_encoded, age) از ستون‌های آرایه‌ای"""
+    scores = np.asarray(scores, dtype=float)
     # نرمال‌سازی نمره
-    score_scaled = scaler.transform([[score]])[0][0]
-    
-    # پیش‌بینی
-    X = np.array([[score_scaled, gender_encoded, age]])
-    category = model.predict(X)[0]
-    
+    scores_scaled = scaler.transform(scores.reshape(-1, 1))[:, 0]
+    return np.column_stack([scores_scaled, encode_genders(genders, le), np.asarray(ages, dtype=float)])
+
+def user_columns(users):
+    """ستون‌های نمره، جنسیت و سن از لیست کاربران با مقادیر پیش‌فرض"""
+    scores = np.array([float(user.get("score", 50)) for user in users], dtype=float)
+    genders = np.array([user.get("gender", "male") for user in users], dtype=str)
+    ages = np.array([int(user.get("age", 25)) for user in users], dtype=float)
+    return scores, genders, ages
+
+def build_features(users, le, scaler):
+    """ساخت ماتریس ویژگی (score_scaled, gender_encoded, age) برای چند کاربر"""
+    return build_feature_matrix(*user_columns(users), le, scaler)
+
+def lookup_columns(table, scores, genders, ages):
+    """جستجوی ستون‌ها در جدول پیش‌بینی؛ خروجی (ماسک ردیف‌های یافته‌شده، ماتریس احتمال)"""
+    gender_codes = encode_genders(genders, CompiledLabelEncoder(table.gender_classes))
+    return table.lookup(scores, gender_codes, ages)
+
+def predict_matrix(X, model):
+    """پیش‌بینی روی ماتریس ویژگی آماده؛ خروجی (دسته‌ها، ماتریس احتمال)"""
+    probabilities = model.predict_proba(X)
+    # همان خروجی model.predict برای جنگل تصادفی، بدون پیمایش دوباره درخت‌ها
+    categories = model.classes_[probabilities.argmax(axis=1)]
+    return categories, probabilities
+
+def predict_columns(scores, genders, ages, model, le, scaler, table=None):
+    """پیش‌بینی از ستون‌ها؛ ردیف‌های موجود در جدول بدون اجرای مدل پاسخ داده می‌شوند"""
+    if table is None:
+        return predict_matrix(build_feature_matrix(scores, genders, ages, le, scaler), model)
+
+    hit, probabilities = lookup_columns(table, scores, genders, ages)
+    miss = ~hit
+    if miss.any():
+        X = build_feature_matrix(scores[miss], genders[miss], ages[miss], le, scaler)
+        _, probabilities[miss] = predict_matrix(X, model)
+    return table.classes_[probabilities.argmax(axis=1)], probabilities
+
+def predict_users(users, model, le, scaler, table=None):
+    """پیش‌بینی دسته‌بندی چند کاربر با یک فراخوانی مدل؛ خروجی (دسته‌ها، ماتریس احتمال)"""
+    return predict_columns(*user_columns(users), model, le, scaler, table)
+
+def predict_user_category(user_data, artifacts=None, table=None):
+    """پیش‌بینی دسته‌بندی کاربر"""
+    columns = user_columns([user_data])
+    hit = False
+    if table is not None:
+        found, probabilities = lookup_columns(table, *columns)
+        hit, classes = found[0], table.classes_
+    if not hit:
+        # مدل فقط برای ورودی‌های خارج از جدول بارگذاری می‌شود
+        model, le, scaler = artifacts or load_model()
+        _, probabilities = predict_matrix(build_feature_matrix(*columns, le, scaler), model)
+        classes = model.classes_
+
     # احتمال‌ها
-    probabilities = model.predict_proba(X)[0]
-    classes = model.classes_
-    prob_dict = {classes[i]: float(prob) for i, prob in enumerate(probabilities)}
-    
+    prob_dict = {classes[i]: float(prob) for i, prob in enumerate(probabilities[0])}
+    category = classes[probabilities[0].argmax()]
+
     return category, prob_dict
 
 def get_recommendations(category):
@@ -88,30 +227,47 @@ def get_recommendations(category):
         "پیاده‌روی کوتاه در طبیعت"
     ])
 
-def main():
-    """تابع اصلی پیش‌بینی"""
+def build_result(category, probabilities):
+    """پاسخ JSON یک کاربر؛ شکل آن بین اجرای CLI و سرور پیش‌بینی یکسان است"""
+    # دریافت پیشنهادات
+    suggestions = get_recommendations(category)
+
+    return {
+        "status": "success",
+        "predicted_category": category,
+        "confidence": probabilities.get(category, 0.0),
+        "all_probabilities": probabilities,
+        "suggestions": suggestions[:3],  # 3 پیشنهاد برتر
+        "personalized_message": f"بر اساس تحلیل شما، دسته‌بندی '{category}' با اطمینان {probabilities.get(category, 0.0):.2f} پیشنهاد می‌شود."
+    }
+
+def run_cli(argv):
+    """اجرای یکی از حالت‌های CLI: پیش‌بینی یک کاربر، --serve یا --batch"""
+    if argv[:1] == ["--serve"]:
+        # حالت سرویس: مدل یک بار بارگذاری و درخواست‌ها از سوکت پاسخ داده می‌شوند
+        from predict_server import main as serve
+        serve(argv[1:])
+        return
+    if argv[:1] == ["--batch"]:
+        # حالت دسته‌ای: NDJSON یا CSV کاربران، خروجی NDJSON
+        from predict_batch import main as batch
+        batch(argv[1:])
+        return
+
     try:
         # دریافت داده‌های کاربر
-        user_data = json.loads(sys.argv[1])
-        
-        # پیش‌بینی دسته‌بندی
-        category, probabilities = predict_user_category(user_data)
+        user_data = json.loads(argv[0])
         
-        # دریافت پیشنهادات
-        suggestions = get_recommendations(category)
+        # پیش‌بینی دسته‌بندی (از جدول پیش‌بینی در صورت وجود)
+        category, probabilities = predict_user_category(user_data, table=load_prediction_table())
         
         # نتیجه نهایی
-        result = {
-            "status": "success",
-            "predicted_category": category,
-            "confidence": probabilities.get(category, 0.0),
-            "all_probabilities": probabilities,
-            "suggestions": suggestions[:3],  # 3 پیشنهاد برتر
-            "personalized_message": f"بر اساس تحلیل شما، دسته‌بندی '{category}' با اطمینان {probabilities.get(category, 0.0):.2f} پیشنهاد می‌شود."
-        }
+        result = build_result(category, probabilities)
         
         print(json.dumps(result, ensure_ascii=False))
         
+    except ModelNotTrainedError:
+        raise
     except Exception as e:
         error_result = {
             "status": "error",
@@ -119,6 +275,17 @@ def main():
         }
         print(json.dumps(error_result, ensure_ascii=False))
 
+def main():
+    """تابع اصلی پیش‌بینی"""
+    try:
+        run_cli(sys.argv[1:])
+    except ModelNotTrainedError as e:
+        print(json.dumps({
+            "status": "error",
+            "message": str(e)
+        }))
+        sys.exit(1)
+
 if __name__ == "__main__":
     main()
 
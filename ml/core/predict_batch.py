@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+پیش‌بینی دسته‌ای Testology
+کاربران از NDJSON یا CSV خوانده می‌شوند، ویژگی‌ها به صورت آرایه‌ای ساخته می‌شوند و
+predict_proba روی هر تکه کامل اجرا می‌شود. خروجی برای هر ردیف ورودی یک خط NDJSON هم‌شکل خروجی predict.py است.
+
+نمونه اجرا:
+    python ml/core/predict.py --batch users.csv -o predictions.ndjson
+    cat users.ndjson | python ml/core/predict.py --batch --format ndjson --jobs -1
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(__file__))
+
+from predict import MODEL_PATH, load_model, load_prediction_table, predict_columns, get_recommendations
+
+DEFAULT_CHUNK_SIZE = 50_000
+# مقادیر پیش‌فرض همانند predict_user_category
+DEFAULTS = {"score": 50, "gender": "male", "age": 25}
+# شناسه‌ای که در صورت وجود در ورودی، در خروجی هم تکرار می‌شود تا نتایج قابل تطبیق باشند
+ID_FIELDS = ("user_id", "id")
+
+
+def _json(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+class ResultWriter:
+    """تولید خطوط NDJSON برای یک تکه؛ بخش‌های ثابت هر دسته یک بار serialize می‌شوند"""
+
+    def __init__(self, classes):
+        self.keys = [_json(str(c)) + ": " for c in classes]
+        self.templates = {}
+        for category in classes:
+            category = str(category)
+            # پیام شخصی‌سازی‌شده به دو بخش ثابت و مقدار اطمینان تقسیم می‌شود
+            prefix, suffix = f"بر اساس تحلیل شما، دسته‌بندی '{category}' با اطمینان ", " پیشنهاد می‌شود."
+            self.templates[category] = (
+                f'"status": "success", "predicted_category": {_json(category)}, "confidence": ',
+                f', "suggestions": {_json(get_recommendations(category)[:3])}, '
+                f'"personalized_message": {_json(prefix)[:-1]}',
+                f'{_json(suffix)[1:]}}}',
+            )
+
+    def lines(self, categories, probabilities, confidence, ids=None, id_field="user_id"):
+        keys = self.keys
+        id_key = "{" + _json(id_field) + ": "
+        for i, (category, row, conf) in enumerate(zip(categories, probabilities.tolist(), confidence.tolist())):
+            head, middle, tail = self.templates[category]
+            probs = ", ".join([key + repr(p) for key, p in zip(keys, row)])
+            prefix = "{" if ids is None else id_key + _json(ids[i]) + ", "
+            yield f'{prefix}{head}{conf!r}, "all_probabilities": {{{probs}}}{middle}{conf:.2f}{tail}'
+
+
+def _error_line(line, message, id_field=None, user_id=None):
+    result = {"status": "error", "line": line, "message": f"خطا در پیش‌بینی: {message}"}
+    if id_field is not None:
+        result = {id_field: user_id, **result}
+    return _json(result)
+
+
+def read_csv_chunks(source, chunk_size):
+    """خواندن CSV به صورت تکه‌ای؛ خروجی DataFrame با شماره خط ورودی"""
+    start = 2  # خط اول سرستون است
+    for frame in pd.read_csv(source, chunksize=chunk_size, dtype={"gender": str, "user_id": str, "id": str}):
+        frame.index = np.arange(start, start + len(frame))
+        start += len(frame)
+        yield frame, []
+
+
+def read_ndjson_chunks(source, chunk_size):
+    """خواندن NDJSON به صورت تکه‌ای؛ خطوط نامعتبر جداگانه به عنوان خطا برگردانده می‌شوند"""
+    numbered = enumerate(source, start=1)
+    while True:
+        lines = list(itertools.islice(numbered, chunk_size))
+        if not lines:
+            return
+        records, line_numbers, errors = [], [], []
+        for number, raw in lines:
+            if not raw.strip():
+                continue
+            try:
+                record = json.loads(raw)
+            except ValueError as e:
+                errors.append((number, str(e)))
+                continue
+            if not isinstance(record, dict):
+                errors.append((number, "هر خط باید یک شیء JSON باشد"))
+                continue
+            records.append(record)
+            line_numbers.append(number)
+        yield pd.DataFrame.from_records(records, index=line_numbers), errors
+
+
+def _load_batch_model():
+    # برای ماتریس‌های بزرگ پیمایش درخت‌ها در sklearn سریع‌تر از مدل کامپایل‌شده است
+    # که برای تأخیر درخواست‌های تکی و دسته‌های کوچک بهینه شده؛ بدون model.pkl همان npz استفاده می‌شود
+    return load_model(prefer_compiled=not os.path.exists(MODEL_PATH))
+
+
+def predict_frame(frame, artifacts, writer, table=None):
+    """پیش‌بینی یک تکه؛ خروجی (لیست (شماره خط، خط NDJSON)، تعداد ردیف‌های نامعتبر)"""
+    model, le, scaler = artifacts
+    id_field = next((field for field in ID_FIELDS if field in frame.columns), None)
+    ids = frame[id_field].astype(object).where(frame[id_field].notna(), None) if id_field else None
+
+    columns = {}
+    for field, default in DEFAULTS.items():
+        column = frame[field] if field in frame.columns else pd.Series(default, index=frame.index)
+        columns[field] = column.where(column.notna(), default)
+    scores = pd.to_numeric(columns["score"], errors="coerce").to_numpy(dtype=float)
+    # int(age) در مسیر تک‌کاربره اعشار را حذف می‌کند
+    ages = np.trunc(pd.to_numeric(columns["age"], errors="coerce").to_numpy(dtype=float))
+    genders = columns["gender"].astype(str).to_numpy()
+
+    valid = np.isfinite(scores) & np.isfinite(ages)
+    output = []
+    for line in frame.index[~valid]:
+        user_id = ids[line] if ids is not None else None
+        output.append((line, _error_line(int(line), "score و age باید عددی باشند", id_field, user_id)))
+    if valid.any():
+        # ردیف‌های موجود در جدول پیش‌بینی بدون اجرای مدل پاسخ داده می‌شوند
+        categories, probabilities = predict_columns(
+            scores[valid], genders[valid], ages[valid], model, le, scaler, table
+        )
+        confidence = probabilities.max(axis=1)
+        valid_ids = ids[valid].tolist() if ids is not None else None
+        output.extend(zip(frame.index[valid], writer.lines(
+            categories.astype(str), probabilities, confidence, valid_ids, id_field
+        )))
+    return output, int((~valid).sum())
+
+
+def predict_batch(source, destination, fmt="ndjson", chunk_size=DEFAULT_CHUNK_SIZE, artifacts=None, table=None):
+    """پیش‌بینی همه کاربران ورودی و نوشتن خروجی به صورت جریانی؛ خروجی آمار اجرا"""
+    artifacts = artifacts or _load_batch_model()
+    writer = ResultWriter(artifacts[0].classes_)
+    reader = read_csv_chunks if fmt == "csv" else read_ndjson_chunks
+    stats = {"rows": 0, "errors": 0}
+
+    for frame, errors in reader(source, chunk_size):
+        output, invalid = predict_frame(frame, artifacts, writer, table) if len(frame) else ([], 0)
+        output.extend((line, _error_line(line, message)) for line, message in errors)
+        if errors or invalid:
+            # ترتیب خروجی همان ترتیب خطوط ورودی است
+            output.sort(key=lambda item: item[0])
+        stats["rows"] += len(output)
+        stats["errors"] += len(errors) + invalid
+        destination.write("\n".join(text for _, text in output))
+        if output:
+            destination.write("\n")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch predictions for NDJSON/CSV user files")
+    parser.add_argument("input", nargs="?", default="-", help="input file (default stdin)")
+    parser.add_argument("-o", "--output", default="-", help="output NDJSON file (default stdout)")
+    parser.add_argument("--format", choices=("ndjson", "csv"), help="input format (default from file extension)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--jobs", type=int, help="number of trees evaluated in parallel (-1 for all cores)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.input.endswith(".csv") else "ndjson")
+    artifacts = _load_batch_model()
+    if args.jobs is not None:
+        artifacts[0].n_jobs = args.jobs
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    destination = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    started = time.perf_counter()
+    try:
+        stats = predict_batch(source, destination, fmt, args.chunk_size, artifacts, load_prediction_table())
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if destination is not sys.stdout:
+            destination.close()
+
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "status": "success", **stats, "seconds": round(elapsed, 2),
+        "rows_per_minute": int(stats["rows"] / elapsed * 60) if elapsed else None
+    }, ensure_ascii=False), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
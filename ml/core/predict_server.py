@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+سرور پیش‌بینی Testology
+مدل یک بار بارگذاری می‌شود و درخواست‌ها از طریق HTTP روی سوکت یونیکس یا TCP پاسخ داده می‌شوند.
+درخواست‌های هم‌زمان در دسته‌های کوچک (micro-batch) با یک فراخوانی predict_proba پیش‌بینی می‌شوند.
+
+نمونه اجرا:
+    python ml/core/predict.py --serve --socket ml/core/predict.sock
+    python ml/core/predict.py --serve --host 127.0.0.1 --port 8765
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__))
+
+from predict import (
+    MODEL_PATH, LABEL_ENCODER_PATH, SCALER_PATH, COMPILED_MODEL_PATH, PREDICTION_TABLE_PATH,
+    load_model, load_prediction_table, user_columns, predict_columns, build_result
+)
+
+DEFAULT_SOCKET = "ml/core/predict.sock"
+MAX_BATCH_SIZE = 256
+# حداکثر انتظار برای جمع شدن درخواست‌های هم‌زمان در یک دسته (ثانیه)
+BATCH_WINDOW = 0.001
+# فاصله بررسی تغییر فایل مدل پس از بازآموزی (ثانیه)
+RELOAD_CHECK_INTERVAL = 5.0
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class ModelHolder:
+    """نگهداری مدل و جدول پیش‌بینی در حافظه و بارگذاری دوباره پس از تغییر فایل‌های مدل"""
+
+    def __init__(self):
+        self.artifacts = load_model()
+        self.table = load_prediction_table()
+        self.version = self._fingerprint()
+        self.checked_at = time.monotonic()
+
+    def _fingerprint(self):
+        paths = (MODEL_PATH, LABEL_ENCODER_PATH, SCALER_PATH, COMPILED_MODEL_PATH, PREDICTION_TABLE_PATH)
+        return tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None for path in paths)
+
+    def get(self):
+        now = time.monotonic()
+        if now - self.checked_at >= RELOAD_CHECK_INTERVAL:
+            self.checked_at = now
+            try:
+                version = self._fingerprint()
+                if version != self.version:
+                    self.artifacts = load_model()
+                    self.table = load_prediction_table()
+                    self.version = version
+            except Exception as e:
+                # فایل حذف شده یا در حال بازنویسی است (pickle ناقص)؛ تا بررسی بعدی مدل قبلی استفاده می‌شود
+                print(f"⚠️ بارگذاری دوباره مدل ناموفق بود: {e}", file=sys.stderr)
+        return self.artifacts, self.table
+
+
+class MicroBatcher:
+    """جمع‌آوری کاربران درخواست‌های هم‌زمان و پیش‌بینی آن‌ها با یک فراخوانی مدل"""
+
+    def __init__(self, holder, max_batch_size=MAX_BATCH_SIZE, window=BATCH_WINDOW):
+        self.holder = holder
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self.queue = asyncio.Queue()
+        # یک thread برای مدل تا event loop در حین پیش‌بینی درخواست‌های بعدی را بخواند
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    @staticmethod
+    def prepare(users):
+        """تبدیل کاربران یک درخواست به ستون‌ها پیش از ادغام، تا داده نامعتبر فقط همان درخواست را رد کند"""
+        columns = user_columns(users)
+        if not (np.isfinite(columns[0]).all() and np.isfinite(columns[2]).all()):
+            raise ValueError("score و age باید عددی باشند")
+        return columns
+
+    async def predict(self, columns):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((columns, future))
+        return await future
+
+    def _predict_columns(self, scores, genders, ages):
+        (model, le, scaler), table = self.holder.get()
+        categories, probabilities = predict_columns(scores, genders, ages, model, le, scaler, table)
+        classes = model.classes_
+        return [
+            build_result(category, {classes[i]: float(p) for i, p in enumerate(row)})
+            for category, row in zip(categories, probabilities)
+        ]
+
+    def _predict_batch(self, batch):
+        """پیش‌بینی دسته؛ خروجی برای هر درخواست لیست نتایج یا استثنای همان درخواست"""
+        try:
+            merged = [np.concatenate([columns[i] for columns, _ in batch]) for i in range(3)]
+            results = self._predict_columns(*merged)
+        except Exception:
+            # خطای فراخوانی ادغام‌شده نباید درخواست‌های سالم همان دسته را ناموفق کند
+            outcomes = []
+            for columns, _ in batch:
+                try:
+                    outcomes.append(self._predict_columns(*columns))
+                except Exception as e:
+                    outcomes.append(e)
+            return outcomes
+
+        outcomes, offset = [], 0
+        for columns, _ in batch:
+            outcomes.append(results[offset:offset + len(columns[0])])
+            offset += len(columns[0])
+        return outcomes
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0][0])
+            deadline = loop.time() + self.window
+            while size < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0][0])
+
+            try:
+                outcomes = await loop.run_in_executor(self.executor, self._predict_batch, batch)
+            except Exception as e:
+                # این حلقه تنها مصرف‌کننده صف است؛ خطا به همه درخواست‌های دسته داده می‌شود و حلقه ادامه می‌یابد
+                outcomes = [e] * len(batch)
+            for (_, future), outcome in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
+
+
+def _response(status, payload, keep_alive):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+    head = (
+        f"HTTP/1.1 {status} {reason.get(status, 'OK')}\r\n"
+        "Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("ascii") + body
+
+
+async def _dispatch(batcher, method, path, body):
+    if method == "GET" and path == "/health":
+        return 200, {"status": "ok"}
+    if method != "POST" or path != "/predict":
+        return 404, {"status": "error", "message": "مسیر یافت نشد"}
+
+    try:
+        payload = json.loads(body or b"null")
+    except ValueError as e:
+        return 400, {"status": "error", "message": f"خطا در پیش‌بینی: {e}"}
+    # یک شیء برای یک کاربر (هم‌شکل خروجی CLI) یا آرایه‌ای از کاربران
+    single = isinstance(payload, dict)
+    users = [payload] if single else payload
+    if not isinstance(users, list) or not all(isinstance(user, dict) for user in users):
+        return 400, {"status": "error", "message": "بدنه باید یک شیء یا آرایه‌ای از اشیای کاربر باشد"}
+    if not users:
+        return 200, []
+
+    try:
+        columns = batcher.prepare(users)
+    except (ValueError, TypeError, OverflowError) as e:
+        return 400, {"status": "error", "message": f"خطا در پیش‌بینی: {str(e)}"}
+    try:
+        results = await batcher.predict(columns)
+    except Exception as e:
+        return 500, {"status": "error", "message": f"خطا در پیش‌بینی: {str(e)}"}
+    return 200, results[0] if single else results
+
+
+async def handle_connection(batcher, reader, writer):
+    """پردازش درخواست‌های HTTP/1.1 روی یک اتصال keep-alive"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            try:
+                method, path, version = request_line.decode("latin-1").split()
+            except ValueError:
+                writer.write(_response(400, {"status": "error", "message": "درخواست نامعتبر"}, False))
+                break
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            length = int(headers.get("content-length", "0") or 0)
+            if length > MAX_BODY_SIZE:
+                writer.write(_response(413, {"status": "error", "message": "بدنه درخواست بیش از حد بزرگ است"}, False))
+                break
+            body = await reader.readexactly(length) if length else b""
+
+            status, payload = await _dispatch(batcher, method, path.split("?", 1)[0], body)
+            writer.write(_response(status, payload, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(socket_path=None, host=None, port=None, max_batch_size=MAX_BATCH_SIZE, window=BATCH_WINDOW):
+    batcher = MicroBatcher(ModelHolder(), max_batch_size, window)
+    batch_task = asyncio.create_task(batcher.run())
+
+    def handler(reader, writer):
+        return handle_connection(batcher, reader, writer)
+
+    if port is not None:
+        server = await asyncio.start_server(handler, host or "127.0.0.1", port)
+        address = f"http://{host or '127.0.0.1'}:{port}"
+    else:
+        socket_path = socket_path or DEFAULT_SOCKET
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(handler, socket_path)
+        address = f"unix:{socket_path}"
+
+    # توقف با SIGTERM از همان مسیر پاک‌سازی سوکت عبور می‌کند
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    print(json.dumps({"status": "serving", "address": address}, ensure_ascii=False), flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batch_task.cancel()
+        if port is None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resident prediction server for ml/core/predict.py")
+    parser.add_argument("--socket", help=f"Unix socket path (default {DEFAULT_SOCKET})")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="listen on TCP instead of a Unix socket")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW * 1000)
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.socket, args.host, args.port, args.max_batch_size, args.batch_window_ms / 1000))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
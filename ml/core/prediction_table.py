@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+جدول پیش‌بینی از پیش محاسبه‌شده Testology
+ورودی مدل فقط نمره، جنسیت و سن است؛ احتمال همه کلاس‌ها برای همه نمره‌ها و سن‌های صحیح
+و همه جنسیت‌ها یک بار پس از آموزش محاسبه می‌شود و پیش‌بینی به یک دسترسی آرایه‌ای تبدیل می‌شود.
+ورودی‌های خارج از جدول (نمره اعشاری، سن یا نمره خارج از بازه) به مدل سپرده می‌شوند.
+
+نمونه اجرا:
+    python ml/core/prediction_table.py          # ساخت ml/core/prediction_table.npz از مدل فعلی
+"""
+
+import os
+import sys
+
+import numpy as np
+
+PREDICTION_TABLE_PATH = "ml/core/prediction_table.npz"
+# بازه‌های معتبر ورودی (شامل دو سر بازه)
+SCORE_RANGE = (0, 100)
+AGE_RANGE = (18, 100)
+# نمره‌های اعشاری با درون‌یابی خطی بین دو نمره صحیح مجاور پاسخ داده شوند؛
+# در حالت پیش‌فرض برای تطابق کامل با خروجی مدل، این ورودی‌ها به مدل سپرده می‌شوند
+INTERPOLATE_SCORES = False
+
+
+def grid_axes():
+    """محورهای جدول: نمره‌ها و سن‌های صحیح در بازه‌های معتبر"""
+    scores = np.arange(SCORE_RANGE[0], SCORE_RANGE[1] + 1, dtype=float)
+    ages = np.arange(AGE_RANGE[0], AGE_RANGE[1] + 1, dtype=float)
+    return scores, ages
+
+
+class PredictionTable:
+    """احتمال کلاس‌ها با ابعاد (نمره، کد جنسیت، سن، کلاس)"""
+
+    def __init__(self, proba, classes, gender_classes, score_min, age_min, fingerprint, source_stat=None):
+        self.proba = proba
+        self.classes_ = classes
+        self.gender_classes = gender_classes
+        self.score_min = int(score_min)
+        self.age_min = int(age_min)
+        self.fingerprint = fingerprint
+        # (اندازه، زمان تغییر) model.pkl هنگام ساخت جدول؛ برای پرهیز از هش کردن فایل در هر بارگذاری
+        self.source_stat = source_stat
+
+    def lookup(self, scores, gender_codes, ages, interpolate=INTERPOLATE_SCORES):
+        """خروجی (ماسک ردیف‌های موجود در جدول، ماتریس احتمال)؛ ردیف‌های خارج از جدول صفر هستند"""
+        scores = np.asarray(scores, dtype=float)
+        gender_codes = np.asarray(gender_codes, dtype=np.intp)
+        score_index = scores - self.score_min
+        age_index = np.asarray(ages, dtype=float) - self.age_min
+        n_scores, n_genders, n_ages, _ = self.proba.shape
+
+        hit = (
+            (score_index >= 0) & (score_index <= n_scores - 1)
+            & (age_index >= 0) & (age_index <= n_ages - 1) & (age_index == np.floor(age_index))
+            & (gender_codes >= 0) & (gender_codes < n_genders)
+        )
+        if not interpolate:
+            hit &= score_index == np.floor(score_index)
+
+        proba = np.zeros((len(scores), self.proba.shape[3]))
+        lower = np.floor(score_index[hit]).astype(np.intp)
+        upper = np.ceil(score_index[hit]).astype(np.intp)
+        g, a = gender_codes[hit], age_index[hit].astype(np.intp)
+        weight = (score_index[hit] - lower)[:, None]
+        proba[hit] = self.proba[lower, g, a]
+        if interpolate:
+            # برای نمره‌های صحیح وزن صفر است و همان ردیف جدول برگردانده می‌شود
+            fractional = weight[:, 0] > 0
+            rows = np.flatnonzero(hit)[fractional]
+            proba[rows] = (
+                (1 - weight[fractional]) * self.proba[lower[fractional], g[fractional], a[fractional]]
+                + weight[fractional] * self.proba[upper[fractional], g[fractional], a[fractional]]
+            )
+        return hit, proba
+
+
+def save_table(proba, classes, gender_classes, fingerprint, path=PREDICTION_TABLE_PATH, source_stat=None):
+    """ذخیره جدول به همراه اثر انگشت و (اندازه، زمان تغییر) model.pkl که از آن ساخته شده است"""
+    arrays = {
+        "proba": proba,
+        "classes": np.asarray(classes).astype(str),
+        "gender_classes": np.asarray(gender_classes).astype(str),
+        "score_min": np.asarray(SCORE_RANGE[0]),
+        "age_min": np.asarray(AGE_RANGE[0]),
+        "fingerprint": np.asarray(fingerprint),
+    }
+    if source_stat is not None:
+        arrays["source_stat"] = np.asarray(source_stat, dtype=np.int64)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_table(path=PREDICTION_TABLE_PATH):
+    """بارگذاری جدول ذخیره‌شده"""
+    with np.load(path, allow_pickle=False) as data:
+        source_stat = tuple(int(v) for v in data["source_stat"]) if "source_stat" in data.files else None
+        return PredictionTable(
+            data["proba"], data["classes"].astype(object), data["gender_classes"],
+            data["score_min"], data["age_min"], str(data["fingerprint"]), source_stat
+        )
+
+
+def main():
+    """ساخت جدول پیش‌بینی از مدل فعلی"""
+    import json
+    sys.path.append(os.path.dirname(__file__))
+    from predict import export_prediction_table
+
+    path = export_prediction_table()
+    print(json.dumps({"status": "success", "path": path}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,7 @@ from sklearn.preprocessing import LabelEncoder, MinMaxScaler
 
 # اضافه کردن مسیر utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from core.predict import export_model_artifacts
 
 MODEL_PATH = "ml/core/model.pkl"
 LOG_PATH = "ml/data/retrain_log.json"
@@ -134,6 +135,8 @@ def retrain_model():
         joblib.dump(model, MODEL_PATH)
         joblib.dump(le, "ml/core/label_encoder.pkl")
         joblib.dump(scaler, "ml/core/scaler.pkl")
+        # نسخه کامپایل‌شده مدل و جدول پیش‌بینی برای پیش‌بینی کم‌تأخیر
+        export_model_artifacts()
         
         # گزارش تفصیلی
         report = classification_report(y_test, y_pred, output_dict=True)
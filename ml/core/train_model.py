@@ -9,6 +9,7 @@ import os
 # اضافه کردن مسیر utils به path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from utils.preprocess import preprocess_data
+from core.predict import export_model_artifacts
 
 def train_model():
     """آموزش مدل یادگیرنده اصلی"""
@@ -39,6 +40,8 @@ def train_model():
         joblib.dump(model, "ml/core/model.pkl")
         joblib.dump(le, "ml/core/label_encoder.pkl")
         joblib.dump(scaler, "ml/core/scaler.pkl")
+        # نسخه کامپایل‌شده مدل و جدول پیش‌بینی برای پیش‌بینی کم‌تأخیر
+        export_model_artifacts()
         
         # گزارش عملکرد
         report = classification_report(y_test, y_pred, output_dict=True)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+خروجی افزایشی نتایج تست‌ها از دیتابیس سرویس برای خط لوله یادگیری ماشین
+هر اجرا فقط ردیف‌های درج‌شده پس از watermark ذخیره‌شده را به صورت یک فایل Parquet جدید اضافه می‌کند.
+watermark روی ingested_at (زمان درج توسط سرور) است نه created_at که در ورود دسته‌ای از کاربر گرفته می‌شود؛
+ردیف‌های EXPORT_LAG_SECONDS آخر دوباره خوانده و با id تکراری‌زدایی می‌شوند تا تراکنش‌هایی که دیرتر commit شده‌اند جا نمانند.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# اضافه کردن ریشه پروژه برای دسترسی به مدل‌های SQLAlchemy سرویس
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from sqlalchemy import select
+
+from analysis_store import migrate_schema
+from database import SessionLocal, engine
+from models import TestResult
+
+EXPORT_DIR = "ml/data/test_results"
+STATE_PATH = "ml/data/test_results_export_state.json"
+BATCH_SIZE = 5000
+PART_ROWS = 100000
+# بیشترین فاصله مجاز بین درج ردیف و commit تراکنش آن (به علاوه اختلاف ساعت workerها)
+EXPORT_LAG_SECONDS = int(os.getenv("EXPORT_LAG_SECONDS", "600"))
+
+SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("user_id", pa.string()),
+    ("test_type", pa.string()),
+    ("mbti_type", pa.string()),
+    ("created_at", pa.timestamp("us")),
+])
+
+
+def empty_state():
+    return {"ingested_at": None, "recent": {}, "parts": 0, "rows": 0}
+
+
+def load_state():
+    """watermark آخرین خروجی (ingested_at)، idهای خروجی‌گرفته در پنجره تأخیر و تعداد فایل‌ها"""
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return empty_state()
+
+
+def save_state(state):
+    tmp_path = f"{STATE_PATH}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def write_part(rows, state, lag=EXPORT_LAG_SECONDS):
+    """نوشتن یک فایل Parquet و جابه‌جایی watermark؛ فایل قبل از به‌روزرسانی وضعیت کامل نوشته می‌شود"""
+    columns = {name: [row[i] for row in rows] for i, name in enumerate(SCHEMA.names)}
+    table = pa.Table.from_pydict(columns, schema=SCHEMA)
+    path = os.path.join(EXPORT_DIR, f"part-{state['parts']:06d}.parquet")
+    pq.write_table(table, f"{path}.tmp", compression="zstd")
+    # اگر اجرا پس از این خط قطع شود، اجرای بعدی همین فایل را بازنویسی می‌کند
+    os.replace(f"{path}.tmp", path)
+
+    # ردیف‌ها به ترتیب ingested_at هستند؛ فقط idهای داخل پنجره تأخیر برای تکراری‌زدایی نگه داشته می‌شوند
+    watermark = rows[-1][5]
+    cutoff = watermark - timedelta(seconds=lag)
+    recent = {row[0]: row[5].isoformat() for row in rows}
+    recent.update(state["recent"])
+    state["recent"] = {
+        row_id: ingested_at for row_id, ingested_at in recent.items()
+        if datetime.fromisoformat(ingested_at) >= cutoff
+    }
+    state["ingested_at"] = watermark.isoformat()
+    state["parts"] += 1
+    state["rows"] += len(rows)
+    save_state(state)
+
+
+def export_incremental(batch_size=BATCH_SIZE, part_rows=PART_ROWS, full=False, lag=EXPORT_LAG_SECONDS):
+    """خواندن جریانی ردیف‌های جدید با yield_per و افزودن آن‌ها به مجموعه داده"""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    with engine.begin() as connection:
+        # افزودن ستون ingested_at اگر سرویس هنوز شمای جدید را اعمال نکرده باشد
+        migrate_schema(connection)
+        for index in TestResult.__table__.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+    state = empty_state() if full else load_state()
+    # وضعیت نسخه قبلی روی created_at بود و ردیف‌های با created_at قدیمی را جا انداخته است
+    if "ingested_at" not in state:
+        full = True
+        state = empty_state()
+    if full:
+        for path in glob.glob(os.path.join(EXPORT_DIR, "part-*.parquet")):
+            os.remove(path)
+
+    query = select(
+        TestResult.id, TestResult.user_id, TestResult.test_type, TestResult.mbti_type,
+        TestResult.created_at, TestResult.ingested_at
+    ).where(TestResult.ingested_at.isnot(None))
+    if state["ingested_at"] is not None:
+        since = datetime.fromisoformat(state["ingested_at"]) - timedelta(seconds=lag)
+        query = query.where(TestResult.ingested_at >= since)
+    query = query.order_by(TestResult.ingested_at, TestResult.id)
+
+    seen = set(state["recent"])
+    exported = 0
+    buffer = []
+    with SessionLocal() as db:
+        # yield_per روی PostgreSQL از cursor سمت سرور استفاده می‌کند و کل نتیجه در حافظه نمی‌آید
+        result = db.execute(query.execution_options(yield_per=batch_size))
+        for partition in result.partitions():
+            buffer.extend(tuple(row) for row in partition if row.id not in seen)
+            while len(buffer) >= part_rows:
+                write_part(buffer[:part_rows], state, lag)
+                exported += part_rows
+                buffer = buffer[part_rows:]
+    if buffer:
+        write_part(buffer, state, lag)
+        exported += len(buffer)
+
+    return {
+        "exported": exported, "total_rows": state["rows"], "parts": state["parts"],
+        "watermark": state["ingested_at"], "full": full
+    }
+
+
+def load_dataset():
+    """خواندن کل مجموعه داده خروجی به صورت DataFrame"""
+    import pandas as pd
+    return pd.read_parquet(EXPORT_DIR)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally export test_results to a Parquet dataset")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows fetched per round trip")
+    parser.add_argument("--part-rows", type=int, default=PART_ROWS, help="maximum rows per Parquet file")
+    parser.add_argument("--full", action="store_true", help="discard the watermark and re-export everything")
+    parser.add_argument("--lag", type=int, default=EXPORT_LAG_SECONDS, help="seconds before the watermark re-scanned for late commits")
+    args = parser.parse_args()
+
+    summary = export_incremental(args.batch_size, args.part_rows, args.full, args.lag)
+    print(json.dumps({"status": "success", **summary}, ensure_ascii=False))
@@ -1,26 +1,59 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
-import uuid
+
+from ids import CompactUUID, new_id
 
 Base = declarative_base()
 
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(CompactUUID, primary_key=True, default=new_id)
     phone = Column(String(11), unique=True, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # پلن اشتراک که سرویس پرداخت به‌روز می‌کند؛ پلن‌های LLM_PRIORITY_PLANS در صف اولویت‌دار مدل قرار می‌گیرند
+    plan = Column(String(20), nullable=False, default="free", server_default="free")
     test_results = relationship("TestResult", back_populates="user")
 
 class TestResult(Base):
     __tablename__ = "test_results"
 
-    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = Column(String(36), ForeignKey("users.id"), nullable=False)
+    id = Column(CompactUUID, primary_key=True, default=new_id)
+    user_id = Column(CompactUUID, ForeignKey("users.id"), nullable=False)
     test_type = Column(String(50), nullable=False)  # برای آینده: MBTI, DISC, etc.
     mbti_type = Column(String(4), nullable=False)
-    analysis = Column(Text, nullable=False)
+    # متن تحلیل یک بار در analysis_blobs ذخیره و اینجا فقط با هش ارجاع داده می‌شود
+    analysis_hash = Column(String(64), ForeignKey("analysis_blobs.hash"), nullable=True)
+    # ستون قدیمی متن کامل؛ برای ردیف‌های جدید خالی است و با analysis_store.backfill منتقل می‌شود
+    legacy_analysis = Column("analysis", Text, nullable=False, default="")
     created_at = Column(DateTime, default=datetime.utcnow)
-    user = relationship("User", back_populates="test_results") 
\ No newline at end of file
+    # زمان درج توسط سرور؛ برخلاف created_at از ورودی کاربر گرفته نمی‌شود و watermark خروجی ML روی آن است
+    ingested_at = Column(DateTime, default=datetime.utcnow, nullable=True)
+    user = relationship("User", back_populates="test_results")
+    blob = relationship("AnalysisBlob", lazy="joined")
+
+    @property
+    def analysis(self) -> str:
+        return self.blob.text if self.blob is not None else self.legacy_analysis
+
+    __table_args__ = (
+        # داشبورد نتایج هر کاربر را به ترتیب زمان صفحه‌بندی می‌کند
+        Index("ix_test_results_user_id_created_at", "user_id", "created_at"),
+        Index("ix_test_results_ingested_at_id", "ingested_at", "id"),
+    )
+
+class AnalysisBlob(Base):
+    __tablename__ = "analysis_blobs"
+
+    hash = Column(String(64), primary_key=True)  # sha256 متن اصلی
+    encoding = Column(String(16), nullable=False)  # identity یا zstd
+    body = Column(LargeBinary, nullable=False)
+    size = Column(Integer, nullable=False)  # طول متن اصلی به بایت
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    @property
+    def text(self) -> str:
+        from analysis_store import decode_analysis
+        return decode_analysis(self.body, self.encoding)
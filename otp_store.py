@@ -0,0 +1,221 @@
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import redis
+
+from database import get_async_redis_client
+from metrics import track_redis
+
+logger = logging.getLogger(__name__)
+
+# تنظیمات OTP
+OTP_TTL = int(os.getenv("OTP_TTL", "300"))
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+OTP_STORE_BACKEND = os.getenv("OTP_STORE_BACKEND", "redis")
+
+# محدودیت ارسال با پنجره لغزان
+OTP_SEND_LIMIT_PER_PHONE = int(os.getenv("OTP_SEND_LIMIT_PER_PHONE", "3"))
+OTP_SEND_WINDOW_PER_PHONE = int(os.getenv("OTP_SEND_WINDOW_PER_PHONE", "600"))
+OTP_SEND_LIMIT_PER_IP = int(os.getenv("OTP_SEND_LIMIT_PER_IP", "20"))
+OTP_SEND_WINDOW_PER_IP = int(os.getenv("OTP_SEND_WINDOW_PER_IP", "600"))
+
+# مقایسه و حذف کد در یک رفت‌وبرگشت؛ پس از OTP_MAX_ATTEMPTS تلاش ناموفق کد باطل می‌شود
+VERIFY_SCRIPT = """
+local stored = redis.call('GET', KEYS[1])
+if not stored then
+  return 0
+end
+if stored == ARGV[1] then
+  redis.call('DEL', KEYS[1], KEYS[2])
+  return 1
+end
+local attempts = redis.call('INCR', KEYS[2])
+if attempts == 1 then
+  redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+end
+if attempts >= tonumber(ARGV[2]) then
+  redis.call('DEL', KEYS[1], KEYS[2])
+end
+return 0
+"""
+
+# پنجره لغزان روی sorted set با زمان خود سرور Redis؛ برای هر کلید یک جفت (سقف، پنجره به میلی‌ثانیه)
+# خروجی صفر یعنی مجاز، در غیر این صورت میلی‌ثانیه تا آزاد شدن
+RATE_LIMIT_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local retry = 0
+for i, key in ipairs(KEYS) do
+  local limit = tonumber(ARGV[2 * i])
+  local window = tonumber(ARGV[2 * i + 1])
+  redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+  if redis.call('ZCARD', key) >= limit then
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    local wait = tonumber(oldest[2]) + window - now
+    if wait > retry then
+      retry = wait
+    end
+  end
+end
+if retry > 0 then
+  return retry
+end
+for i, key in ipairs(KEYS) do
+  redis.call('ZADD', key, now, ARGV[1])
+  redis.call('PEXPIRE', key, tonumber(ARGV[2 * i + 1]))
+end
+return 0
+"""
+
+
+def _otp_key(phone: str) -> str:
+    return f"otp:{phone}"
+
+
+def _attempts_key(phone: str) -> str:
+    return f"otp:{phone}:attempts"
+
+
+def _send_limits(phone: str, ip: Optional[str]) -> List[Tuple[str, int, int]]:
+    """کلیدها و سقف‌های محدودیت ارسال برای یک شماره و IP"""
+    limits = [(f"otp:rl:phone:{phone}", OTP_SEND_LIMIT_PER_PHONE, OTP_SEND_WINDOW_PER_PHONE)]
+    if ip:
+        limits.append((f"otp:rl:ip:{ip}", OTP_SEND_LIMIT_PER_IP, OTP_SEND_WINDOW_PER_IP))
+    return limits
+
+
+class RedisOTPStore:
+    """ذخیره‌ساز OTP روی Redis ناهمگام"""
+
+    def __init__(self, client):
+        self.client = client
+        self._verify = client.register_script(VERIFY_SCRIPT)
+        self._rate_limit = client.register_script(RATE_LIMIT_SCRIPT)
+
+    async def store(self, phone: str, otp: str, ttl: int = OTP_TTL):
+        """ذخیره کد و صفر کردن شمارنده تلاش‌ها"""
+        pipe = self.client.pipeline(transaction=True)
+        pipe.setex(_otp_key(phone), ttl, otp)
+        pipe.delete(_attempts_key(phone))
+        with track_redis("otp_store"):
+            await pipe.execute()
+
+    async def verify(self, phone: str, otp: str) -> bool:
+        """بررسی و مصرف کد در یک رفت‌وبرگشت"""
+        with track_redis("otp_verify"):
+            result = await self._verify(
+                keys=[_otp_key(phone), _attempts_key(phone)],
+                args=[otp, OTP_MAX_ATTEMPTS, OTP_TTL],
+            )
+        return result == 1
+
+    async def store_many(self, items: Iterable[Tuple[str, str]], ttl: int = OTP_TTL):
+        """ذخیره گروهی کدها در یک pipeline"""
+        pipe = self.client.pipeline(transaction=False)
+        for phone, otp in items:
+            pipe.setex(_otp_key(phone), ttl, otp)
+            pipe.delete(_attempts_key(phone))
+        with track_redis("otp_store_many"):
+            await pipe.execute()
+
+    async def verify_many(self, items: Sequence[Tuple[str, str]]) -> List[bool]:
+        """بررسی گروهی کدها در یک pipeline"""
+        pipe = self.client.pipeline(transaction=False)
+        for phone, otp in items:
+            await self._verify(
+                keys=[_otp_key(phone), _attempts_key(phone)],
+                args=[otp, OTP_MAX_ATTEMPTS, OTP_TTL],
+                client=pipe,
+            )
+        with track_redis("otp_verify_many"):
+            results = await pipe.execute()
+        return [result == 1 for result in results]
+
+    async def check_send_limit(self, phone: str, ip: Optional[str] = None) -> float:
+        """ثبت یک ارسال؛ صفر یعنی مجاز و در غیر این صورت ثانیه‌های باقی‌مانده تا ارسال بعدی"""
+        limits = _send_limits(phone, ip)
+        args = [uuid.uuid4().hex]
+        for _, limit, window in limits:
+            args.extend([limit, window * 1000])
+        try:
+            with track_redis("otp_rate_limit"):
+                retry_ms = await self._rate_limit(keys=[key for key, _, _ in limits], args=args)
+        except redis.RedisError as e:
+            # خرابی Redis نباید ورود کاربران را کاملاً متوقف کند
+            logger.warning(f"خطا در بررسی محدودیت ارسال OTP: {e}")
+            return 0.0
+        return int(retry_ms) / 1000
+
+
+class MemoryOTPStore:
+    """ذخیره‌ساز درون‌حافظه‌ای OTP برای تست و اجرای محلی"""
+
+    def __init__(self):
+        self._codes: Dict[str, Tuple[str, float]] = {}
+        self._attempts: Dict[str, int] = {}
+        self._sends: Dict[str, deque] = {}
+
+    async def store(self, phone: str, otp: str, ttl: int = OTP_TTL):
+        self._codes[phone] = (otp, time.monotonic() + ttl)
+        self._attempts.pop(phone, None)
+
+    async def verify(self, phone: str, otp: str) -> bool:
+        entry = self._codes.get(phone)
+        if entry is None or entry[1] <= time.monotonic():
+            self._codes.pop(phone, None)
+            return False
+        if entry[0] == otp:
+            del self._codes[phone]
+            self._attempts.pop(phone, None)
+            return True
+        self._attempts[phone] = self._attempts.get(phone, 0) + 1
+        if self._attempts[phone] >= OTP_MAX_ATTEMPTS:
+            del self._codes[phone]
+            del self._attempts[phone]
+        return False
+
+    async def store_many(self, items: Iterable[Tuple[str, str]], ttl: int = OTP_TTL):
+        for phone, otp in items:
+            await self.store(phone, otp, ttl)
+
+    async def verify_many(self, items: Sequence[Tuple[str, str]]) -> List[bool]:
+        return [await self.verify(phone, otp) for phone, otp in items]
+
+    async def check_send_limit(self, phone: str, ip: Optional[str] = None) -> float:
+        now = time.monotonic()
+        limits = _send_limits(phone, ip)
+        retry = 0.0
+        for key, limit, window in limits:
+            sends = self._sends.setdefault(key, deque())
+            while sends and sends[0] <= now - window:
+                sends.popleft()
+            if len(sends) >= limit:
+                retry = max(retry, sends[0] + window - now)
+        if retry > 0:
+            return retry
+        for key, _, _ in limits:
+            self._sends[key].append(now)
+        return 0.0
+
+
+def create_otp_store():
+    """انتخاب ذخیره‌ساز OTP بر اساس OTP_STORE_BACKEND"""
+    if OTP_STORE_BACKEND == "memory":
+        logger.info("OTP store: in-memory")
+        return MemoryOTPStore()
+    return RedisOTPStore(get_async_redis_client())
+
+
+_otp_store = None
+
+
+def get_otp_store():
+    """ذخیره‌ساز OTP مشترک که در اولین استفاده ساخته می‌شود"""
+    global _otp_store
+    if _otp_store is None:
+        _otp_store = create_otp_store()
+    return _otp_store
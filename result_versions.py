@@ -0,0 +1,91 @@
+import hashlib
+import logging
+import os
+import time
+from typing import Optional, Set
+
+import redis
+
+from database import get_async_redis_client
+from metrics import track_redis
+
+logger = logging.getLogger(__name__)
+
+# نسخه نتایج هر کاربر؛ با هر نوشتن در test_results یک واحد بالا می‌رود
+RESULTS_VERSION_TTL = int(os.getenv("RESULTS_VERSION_TTL", str(30 * 24 * 3600)))
+RESULTS_VERSION_BUMP_ATTEMPTS = int(os.getenv("RESULTS_VERSION_BUMP_ATTEMPTS", "2"))
+
+# کاربرانی که نسخه آن‌ها پس از نوشتن به‌روز نشد؛ تا حذف کلید نسخه، ETag برایشان ساخته نمی‌شود
+_unknown_versions: Set[str] = set()
+
+
+def _version_key(user_id: str) -> str:
+    return f"results:version:{user_id}"
+
+
+async def get_results_version(user_id: str) -> Optional[str]:
+    """نسخه فعلی نتایج کاربر؛ None یعنی Redis در دسترس نیست و ETag ساخته نمی‌شود"""
+    key = _version_key(user_id)
+    client = get_async_redis_client()
+    if user_id in _unknown_versions and not await _discard_version(user_id):
+        return None
+    try:
+        with track_redis("results_version_get"):
+            version = await client.get(key)
+            if version is None:
+                # مقدار اولیه از زمان، تا پس از پاک شدن Redis ETagهای قدیمی تصادفاً معتبر نشوند
+                await client.set(key, time.time_ns(), nx=True, ex=RESULTS_VERSION_TTL)
+                version = await client.get(key)
+    except redis.RedisError as e:
+        logger.warning(f"خطا در خواندن نسخه نتایج {user_id}: {e}")
+        return None
+    return version.decode() if version is not None else None
+
+
+async def _discard_version(user_id: str) -> bool:
+    """حذف کلید نسخه؛ خواندن بعدی نسخه جدیدی از زمان می‌سازد و هیچ ETag قبلی معتبر نمی‌ماند"""
+    try:
+        with track_redis("results_version_discard"):
+            await get_async_redis_client().delete(_version_key(user_id))
+    except redis.RedisError as e:
+        logger.warning(f"خطا در حذف نسخه نتایج {user_id}: {e}")
+        return False
+    _unknown_versions.discard(user_id)
+    return True
+
+
+async def bump_results_version(user_id: str):
+    """باطل کردن ETagهای قبلی پس از ثبت نتیجه جدید"""
+    key = _version_key(user_id)
+    for _ in range(max(1, RESULTS_VERSION_BUMP_ATTEMPTS)):
+        try:
+            pipe = get_async_redis_client().pipeline(transaction=True)
+            pipe.set(key, time.time_ns(), nx=True, ex=RESULTS_VERSION_TTL)
+            pipe.incr(key)
+            pipe.expire(key, RESULTS_VERSION_TTL)
+            with track_redis("results_version_bump"):
+                await pipe.execute()
+            _unknown_versions.discard(user_id)
+            return
+        except redis.RedisError as e:
+            logger.warning(f"خطا در به‌روزرسانی نسخه نتایج {user_id}: {e}")
+
+    # نسخه قبلی نباید معتبر بماند؛ اگر حذف هم ناموفق باشد ETag این کاربر تا حذف موفق غیرفعال است
+    if not await _discard_version(user_id):
+        _unknown_versions.add(user_id)
+
+
+def make_etag(version: str, *variant: str) -> str:
+    """ETag ضعیف از نسخه نتایج و پارامترهایی که شکل پاسخ را تغییر می‌دهند"""
+    digest = hashlib.sha1("|".join((version, *variant)).encode()).hexdigest()[:16]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """مقایسه ضعیف ETag با هدر If-None-Match"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
@@ -0,0 +1,43 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from admission import AdmissionController, is_priority_user
+from auth import CurrentUser
+from models import User
+
+
+def test_plan_is_read_from_user_record():
+    premium = CurrentUser.from_user(User(id="u1", phone="09120000001", plan="premium"))
+    free = CurrentUser.from_user(User(id="u2", phone="09120000002", plan="free"))
+    assert is_priority_user(premium.plan)
+    assert not is_priority_user(free.plan)
+
+
+def test_priority_user_goes_ahead_of_normal_queue():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_per_user=5, queue_timeout=5)
+        running = await controller.acquire("busy")
+        order = []
+
+        async def wait(user: CurrentUser):
+            ticket = await controller.acquire(user.id, is_priority_user(user.plan))
+            order.append(user.id)
+            ticket.release()
+
+        normal = [CurrentUser(id=f"free-{i}", phone="", plan="free") for i in range(3)]
+        premium = CurrentUser(id="premium", phone="", plan="premium")
+        tasks = [asyncio.create_task(wait(user)) for user in normal]
+        await asyncio.sleep(0)
+        # کاربر پولی پس از همه کاربران عادی وارد صف می‌شود
+        tasks.append(asyncio.create_task(wait(premium)))
+        await asyncio.sleep(0)
+        assert controller.queued == 4
+
+        running.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["premium", "free-0", "free-1", "free-2"]